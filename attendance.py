@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+from config import subject_csv_file
+from matching import match_faces
+from instrumentation import StageTimer
+
+# A confirmed match becomes a new reference encoding for the student when it
+# is confident (close, and clearly closer than any other student) yet not a
+# near-copy of what is already stored
+LEARN_DISTANCE = 0.4
+LEARN_MARGIN = 0.1
+MIN_NOVELTY = 0.15
+MAX_REFERENCES = 20
+
+
+def load_roster(subject, branch, semester):
+    return pd.read_csv(subject_csv_file(subject, branch, semester))['Scholar No'].tolist()
+
+
+def mark_attendance(subject, branch, semester, photo_results, face_store, attendance_store,
+                    tolerance, date=None, metrics=None, learn=False, roster=None):
+    # Match the (locations, encodings) of every photo in a session against
+    # the subject's roster and append the session to the attendance store.
+    # `roster` saves re-reading the subject CSV when the caller already has
+    # it. Returns the new session id and the MatchResult.
+    timer = metrics or StageTimer()
+    roster_file = subject_csv_file(subject, branch, semester)
+
+    # Gather each student's prototype encodings from the face store
+    with timer.stage("encoding_load"):
+        scholar_numbers = load_roster(subject, branch, semester) if roster is None else roster
+        known_scholars, known_matrix, known_offsets = face_store.get_prototypes(scholar_numbers)
+
+    # Match every photo's faces at once
+    with timer.stage("matching"):
+        photo_encodings = [encodings for _, encodings in photo_results]
+        result = match_faces(known_scholars, known_matrix, photo_encodings, tolerance=tolerance,
+                             known_offsets=known_offsets)
+
+    # Students without a face encoding are marked absent
+    attendance = {scholar: 0 for scholar in scholar_numbers}
+    attendance.update(result.attendance())
+    distances = result.assigned_distance_map()
+
+    # Import any date columns left in the old wide subject CSV first
+    with timer.stage("write"):
+        attendance_store.import_wide_csv(subject, branch, semester, roster_file)
+        session_id = attendance_store.record_session(subject, branch, semester, attendance, distances, date,
+                                                     faces=matched_faces(result, photo_encodings))
+
+    if learn:
+        with timer.stage("learn"):
+            learn_references(result, photo_encodings, face_store)
+    return session_id, result
+
+
+def merge_late_photos(session_id, photo_results, face_store, attendance_store, tolerance, metrics=None,
+                      learn=False):
+    # Add photos taken after a session was marked. Only the new photos are
+    # encoded, and they are matched against the students still absent. Each
+    # present student competes with the face they were matched on earlier,
+    # so a present student in the late photo can't be taken for an absent
+    # look-alike. Returns the newly present scholar numbers and the
+    # MatchResult.
+    timer = metrics or StageTimer()
+
+    with timer.stage("encoding_load"):
+        attendance = attendance_store.session_attendance(session_id)
+        absent = [scholar for scholar, present in attendance.items() if not present]
+        absent_scholars, absent_matrix, absent_offsets = face_store.get_prototypes(absent)
+        present_scholars, present_matrix = attendance_store.session_faces(session_id)
+
+        scholars = absent_scholars + present_scholars
+        known_matrix = np.vstack([absent_matrix, present_matrix])
+        known_offsets = np.concatenate([absent_offsets, len(absent_matrix) + np.arange(len(present_scholars))])
+
+    with timer.stage("matching"):
+        photo_encodings = [encodings for _, encodings in photo_results]
+        result = match_faces(scholars, known_matrix, photo_encodings, tolerance=tolerance,
+                             known_offsets=known_offsets)
+
+    newly_present = set(absent_scholars) & result.present
+    with timer.stage("write"):
+        faces = matched_faces(result, photo_encodings)
+        distances = result.assigned_distance_map()
+        updated = attendance_store.merge_into_session(
+            session_id, {scholar: distances[scholar] for scholar in newly_present},
+            {scholar: faces[scholar] for scholar in newly_present})
+
+    # Present students were matched against their face from earlier in the
+    # session, not their enrolled references, so only the absent block learns
+    if learn:
+        with timer.stage("learn"):
+            learn_references(result, photo_encodings, face_store, students=range(len(absent_scholars)))
+    return updated, result
+
+
+def matched_faces(result, photo_encodings):
+    # scholar no -> the encoding of the face they were matched on
+    faces = [encoding for encodings in photo_encodings for encoding in encodings]
+    return {
+        scholar: faces[face]
+        for scholar, face in zip(result.scholars, result.assigned_faces) if face >= 0
+    }
+
+
+def learn_references(result, photo_encodings, face_store, students=None):
+    # Add confident matches as extra reference encodings; returns how many.
+    # `students` limits this to those rows of the result.
+    faces = [encoding for encodings in photo_encodings for encoding in encodings]
+    new_references = []
+    for student in range(len(result.scholars)) if students is None else students:
+        face = result.assigned_faces[student]
+        if face < 0:
+            continue
+        scholar = result.scholars[student]
+        distance = result.distances[student, face]
+        if (MIN_NOVELTY <= distance <= LEARN_DISTANCE and result.margins[student] >= LEARN_MARGIN
+                and face_store.reference_count(scholar) < MAX_REFERENCES):
+            new_references.append((scholar, faces[face]))
+
+    face_store.add_many(new_references)
+    return len(new_references)
+
+
+def identify_unmatched(result, photo_results, campus_index, roster, k=3):
+    # Look every face the roster didn't match up in the campus-wide index.
+    # Returns (photo index, face box, [(scholar no, distance), ...]) per face;
+    # candidates farther than the subject's tolerance are dropped.
+    faces = [
+        (photo_index, box, encoding)
+        for photo_index, (locations, encodings) in enumerate(photo_results)
+        for box, encoding in zip(locations, encodings)
+    ]
+    unmatched = [faces[face] for face in result.unmatched_faces]
+    if not unmatched:
+        return []
+
+    candidates = campus_index.search([encoding for _, _, encoding in unmatched], k=k, exclude=roster)
+    return [
+        (photo_index, box, [(scholar, distance) for scholar, distance in matches if distance <= result.tolerance])
+        for (photo_index, box, _), matches in zip(unmatched, candidates)
+    ]
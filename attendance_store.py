@@ -0,0 +1,274 @@
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+FACE_DTYPE = np.float32
+
+DATE_COLUMN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    date TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_subject_date
+    ON sessions (subject, branch, semester, date);
+
+CREATE TABLE IF NOT EXISTS attendance (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id),
+    scholar_no TEXT NOT NULL,
+    present INTEGER NOT NULL,
+    distance REAL,
+    PRIMARY KEY (session_id, scholar_no)
+);
+CREATE INDEX IF NOT EXISTS attendance_by_scholar
+    ON attendance (scholar_no);
+
+-- Running totals per (student, subject), kept in step with every session
+CREATE TABLE IF NOT EXISTS counters (
+    scholar_no TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    attended INTEGER NOT NULL DEFAULT 0,
+    held INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scholar_no, subject, branch, semester)
+);
+CREATE INDEX IF NOT EXISTS counters_by_class
+    ON counters (branch, semester);
+
+-- The face each present student was matched on (float32 encoding bytes), so
+-- a late photo can be merged into a session without re-encoding the others
+CREATE TABLE IF NOT EXISTS session_faces (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id),
+    scholar_no TEXT NOT NULL,
+    encoding BLOB NOT NULL,
+    PRIMARY KEY (session_id, scholar_no)
+);
+"""
+
+
+def subject_key(subject, branch, semester):
+    # Subjects are identified the same way as their CSV files: lower-cased
+    return str(subject).strip().lower(), str(branch).strip().lower(), str(semester).strip()
+
+
+class AttendanceStore:
+    # Attendance in long format, one row per (session, student), kept in an
+    # embedded SQLite database. Marking a session appends one row per student
+    # on the roster instead of rewriting a subject CSV that grows a column
+    # every lecture, and several sessions on the same day are kept apart.
+
+    def __init__(self, db_file="attendance.db"):
+        self.db_file = db_file
+
+    @contextmanager
+    def connect(self, immediate=False):
+        # Commits on success, rolls back on error, always closes. With
+        # immediate, the write lock is taken up front, so what is read in the
+        # transaction can't change before it writes.
+        connection = sqlite3.connect(self.db_file)
+        try:
+            connection.execute("PRAGMA foreign_keys = ON")
+            with connection:
+                if immediate:
+                    connection.execute("BEGIN IMMEDIATE")
+                yield connection
+        finally:
+            connection.close()
+
+    def setup(self):
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+            needs_counters = (
+                connection.execute("SELECT 1 FROM attendance LIMIT 1").fetchone() is not None
+                and connection.execute("SELECT 1 FROM counters LIMIT 1").fetchone() is None
+            )
+
+        # Databases written before the counters existed get them filled in once
+        if needs_counters:
+            self.rebuild_counters()
+
+    def _new_session_id(self, connection, key, date):
+        # Readable ids: <subject>-<branch>-<semester>-<date>-<n>. Joining with
+        # "-" is ambiguous (subject "a-b" of branch "c" and subject "a" of
+        # branch "b-c"), so n skips ids another subject already has. Needs
+        # an immediate transaction, or two processes could pick the same n.
+        count = connection.execute(
+            "SELECT COUNT(*) FROM sessions WHERE subject = ? AND branch = ? AND semester = ? AND date = ?",
+            (*key, date),
+        ).fetchone()[0]
+        number = count + 1
+        while connection.execute("SELECT 1 FROM sessions WHERE session_id = ?",
+                                 (f"{'-'.join(key)}-{date}-{number}",)).fetchone():
+            number += 1
+        return f"{'-'.join(key)}-{date}-{number}"
+
+    def record_session(self, subject, branch, semester, attendance, distances=None, date=None, faces=None):
+        # attendance maps scholar no -> 0/1, distances scholar no -> match
+        # distance (None when absent), faces scholar no -> the encoding they
+        # were matched on. Returns the new session id.
+        key = subject_key(subject, branch, semester)
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        distances = distances or {}
+
+        with self.connect(immediate=True) as connection:
+            session_id = self._new_session_id(connection, key, date)
+            connection.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, *key, date, datetime.now().isoformat(timespec='seconds')),
+            )
+            connection.executemany(
+                "INSERT INTO attendance VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, str(scholar), int(present), distances.get(scholar))
+                    for scholar, present in attendance.items()
+                ],
+            )
+            connection.executemany(
+                "INSERT INTO counters VALUES (?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT (scholar_no, subject, branch, semester) DO UPDATE SET "
+                "attended = attended + excluded.attended, held = held + 1",
+                [(str(scholar), *key, int(present)) for scholar, present in attendance.items()],
+            )
+            self._insert_faces(connection, session_id, faces)
+        return session_id
+
+    def _insert_faces(self, connection, session_id, faces):
+        connection.executemany(
+            "INSERT OR REPLACE INTO session_faces VALUES (?, ?, ?)",
+            [
+                (session_id, str(scholar), np.asarray(encoding, dtype=FACE_DTYPE).tobytes())
+                for scholar, encoding in (faces or {}).items()
+            ],
+        )
+
+    def latest_session(self, subject, branch, semester, date=None):
+        # Id of the most recent session on `date` (default today), or None
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT session_id FROM sessions WHERE subject = ? AND branch = ? AND semester = ? AND date = ? "
+                "ORDER BY created_at DESC, rowid DESC LIMIT 1",
+                (*subject_key(subject, branch, semester), date),
+            ).fetchone()
+        return row[0] if row else None
+
+    def session_attendance(self, session_id):
+        # scholar no -> 0/1 for one session
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT scholar_no, present FROM attendance WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        if not rows:
+            raise KeyError(f"Unknown session: {session_id}")
+        return dict(rows)
+
+    def session_faces(self, session_id):
+        # Scholar numbers and the (n, 128) encodings they were matched on
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT scholar_no, encoding FROM session_faces WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        matrix = np.frombuffer(b"".join(encoding for _, encoding in rows), dtype=FACE_DTYPE)
+        return [scholar for scholar, _ in rows], matrix.reshape(-1, 128)
+
+    def merge_into_session(self, session_id, distances, faces=None):
+        # Mark more students present in an existing session. distances maps
+        # each newly present scholar no -> match distance. Students already
+        # present are left alone, so counters only count real changes.
+        # Returns the scholar numbers that were updated.
+        with self.connect() as connection:
+            key = connection.execute(
+                "SELECT subject, branch, semester FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if key is None:
+                raise KeyError(f"Unknown session: {session_id}")
+
+            updated = []
+            for scholar, distance in distances.items():
+                changed = connection.execute(
+                    "UPDATE attendance SET present = 1, distance = ? "
+                    "WHERE session_id = ? AND scholar_no = ? AND present = 0",
+                    (distance, session_id, str(scholar)),
+                ).rowcount
+                if changed:
+                    updated.append(scholar)
+
+            connection.executemany(
+                "UPDATE counters SET attended = attended + 1 "
+                "WHERE scholar_no = ? AND subject = ? AND branch = ? AND semester = ?",
+                [(str(scholar), *key) for scholar in updated],
+            )
+            self._insert_faces(connection, session_id, {scholar: faces[scholar] for scholar in updated
+                                                        if faces and scholar in faces})
+        return updated
+
+    def rebuild_counters(self):
+        # Recompute every counter from the attendance records
+        with self.connect() as connection:
+            connection.execute("DELETE FROM counters")
+            connection.execute(
+                "INSERT INTO counters "
+                "SELECT a.scholar_no, s.subject, s.branch, s.semester, SUM(a.present), COUNT(*) "
+                "FROM attendance a JOIN sessions s ON s.session_id = a.session_id "
+                "GROUP BY a.scholar_no, s.subject, s.branch, s.semester"
+            )
+
+    def sessions(self, subject, branch, semester):
+        with self.connect() as connection:
+            return pd.read_sql_query(
+                "SELECT session_id, date, created_at FROM sessions "
+                "WHERE subject = ? AND branch = ? AND semester = ? ORDER BY date, created_at, session_id",
+                connection, params=subject_key(subject, branch, semester),
+            )
+
+    def records(self, subject, branch, semester):
+        with self.connect() as connection:
+            return pd.read_sql_query(
+                "SELECT s.session_id, s.date, a.scholar_no, a.present, a.distance "
+                "FROM attendance a JOIN sessions s ON s.session_id = a.session_id "
+                "WHERE s.subject = ? AND s.branch = ? AND s.semester = ?",
+                connection, params=subject_key(subject, branch, semester),
+            )
+
+    def export_wide(self, subject, branch, semester, scholar_numbers):
+        # Rebuild the old spreadsheet layout: one row per student, one column
+        # per session. A second session on the same date becomes "<date> (2)".
+        sessions = self.sessions(subject, branch, semester)
+        records = self.records(subject, branch, semester)
+
+        pivot = records.pivot(index="scholar_no", columns="session_id", values="present")
+        keys = pd.Series(list(scholar_numbers)).astype(str)
+        pivot = pivot.reindex(index=keys, columns=sessions["session_id"]).fillna(0).astype(int)
+
+        columns = []
+        per_date = {}
+        for date in sessions["date"]:
+            per_date[date] = per_date.get(date, 0) + 1
+            columns.append(date if per_date[date] == 1 else f"{date} ({per_date[date]})")
+
+        pivot.columns = columns
+        wide_df = pd.DataFrame({"Scholar No": list(scholar_numbers)})
+        return pd.concat([wide_df, pivot.reset_index(drop=True)], axis=1)
+
+    def import_wide_csv(self, subject, branch, semester, subject_csv_file):
+        # One-shot import of the date columns of an old wide subject CSV.
+        # Skipped once the subject has any session in the store.
+        if not self.sessions(subject, branch, semester).empty:
+            return 0
+
+        subject_df = pd.read_csv(subject_csv_file)
+        date_columns = [column for column in subject_df.columns if DATE_COLUMN.match(str(column))]
+        for column in date_columns:
+            attendance = dict(zip(subject_df["Scholar No"], subject_df[column].fillna(0).astype(int)))
+            self.record_session(subject, branch, semester, attendance, date=column)
+        return len(date_columns)
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import subject_csv_file
+from face_store import FaceStore
+from matching import DEFAULT_TOLERANCE, match_faces
+from attendance import mark_attendance
+from attendance_store import AttendanceStore
+
+SAMPLE_PHOTOS = ["multif1.jpg", "raghav.png", "rishit.jpg", "shouvik.jpg"]
+ROSTER_SIZES = [50, 500, 5000, 20000]
+HISTORY_DAYS = [1, 30, 200]
+
+# Fraction of the roster visible in a synthetic class photo
+PRESENT_FRACTION = 0.8
+
+# References added to the students whose prototypes get clustered
+EXTRA_REFERENCES = 5
+
+
+def synthetic_encodings(count, seed=0):
+    # Random unit-ish vectors scaled like dlib encodings (distances ~1.0
+    # between different people)
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(count, 128))
+    return encodings / np.linalg.norm(encodings, axis=1, keepdims=True) * 0.7
+
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings), "repeat": repeat}
+
+
+def bench_encoding_load(work_dir, roster_size, repeat):
+    # Prototype load as mark_attendance does it. Every fourth student has
+    # more references than PROTOTYPES_PER_STUDENT, so they are clustered:
+    # "cold" includes the k-means and the .proto.npz write, "warm" reads the
+    # prototypes back from that file.
+    store = FaceStore(os.path.join(work_dir, f"faces-{roster_size}.bin"),
+                      os.path.join(work_dir, f"faces-{roster_size}.idx"))
+    scholars = [str(100000 + i) for i in range(roster_size)]
+    store.add_many(zip(scholars, synthetic_encodings(roster_size)))
+    clustered = scholars[::4]
+    extra = synthetic_encodings(len(clustered) * EXTRA_REFERENCES, seed=3)
+    store.add_many(zip(np.repeat(clustered, EXTRA_REFERENCES), extra))
+
+    # Open the store from scratch each time, as a new session would
+    def load():
+        FaceStore(store.matrix_file, store.index_file).get_prototypes(scholars)
+
+    def cold_load():
+        if os.path.exists(store.prototype_file):
+            os.remove(store.prototype_file)
+        load()
+
+    return {"cold": time_call(cold_load, repeat), "warm": time_call(load, repeat)}
+
+
+def bench_matching(roster_size, repeat):
+    known = synthetic_encodings(roster_size)
+    rng = np.random.default_rng(1)
+    present = rng.choice(roster_size, size=max(1, int(roster_size * PRESENT_FRACTION)), replace=False)
+    faces = known[present] + rng.normal(scale=0.01, size=(len(present), 128))
+    scholars = list(range(roster_size))
+    return time_call(lambda: match_faces(scholars, known, [faces]), repeat)
+
+
+def bench_attendance_write(work_dir, roster_size, history_days, repeat):
+    # One whole mark_attendance call: roster and prototype load, matching and
+    # the session write, against a store that already holds history_days
+    # sessions. The roster CSV is read from the working directory, like the
+    # app does, so the benchmark runs from inside work_dir.
+    store = AttendanceStore(os.path.join(work_dir, f"attendance-{roster_size}-{history_days}.db"))
+    store.setup()
+    face_store = FaceStore(os.path.join(work_dir, f"session-faces-{roster_size}-{history_days}.bin"),
+                           os.path.join(work_dir, f"session-faces-{roster_size}-{history_days}.idx"))
+    scholars = [str(100000 + i) for i in range(roster_size)]
+    known = synthetic_encodings(roster_size)
+    face_store.add_many(zip(scholars, known))
+    rng = np.random.default_rng(2)
+
+    # Build up the session history before timing the next session
+    start_date = date(2026, 1, 1)
+    for day in range(history_days):
+        attendance = dict(zip(scholars, (rng.random(roster_size) < PRESENT_FRACTION).astype(int)))
+        store.record_session("bench", "cse", "5", attendance, date=str(start_date + timedelta(days=day)))
+
+    present = rng.choice(roster_size, size=max(1, int(roster_size * PRESENT_FRACTION)), replace=False)
+    faces = known[present] + rng.normal(scale=0.01, size=(len(present), 128))
+    photo_results = [([(0, 1, 1, 0)] * len(faces), faces)]
+    session_date = str(start_date + timedelta(days=history_days))
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        pd.DataFrame({"Scholar No": scholars}).to_csv(subject_csv_file("bench", "cse", "5"), index=False)
+        return time_call(lambda: mark_attendance("bench", "cse", "5", photo_results, face_store, store,
+                                                 DEFAULT_TOLERANCE, date=session_date), repeat)
+    finally:
+        os.chdir(cwd)
+
+
+def bench_recognition(photo_dir, repeat):
+    # Detection and encoding on the sample photos; needs face_recognition
+    try:
+        import face_recognition
+        from recognition import detect_faces, load_image
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    results = {}
+    for photo in SAMPLE_PHOTOS:
+        path = os.path.join(photo_dir, photo)
+        if not os.path.exists(path):
+            continue
+        image, _ = load_image(path)
+        locations = detect_faces(image)
+        results[photo] = {
+            "decode": time_call(lambda: load_image(path), repeat),
+            "detection": time_call(lambda: detect_faces(image), repeat),
+            "encoding": time_call(lambda: face_recognition.face_encodings(image, locations), repeat),
+            "faces": len(locations),
+        }
+    return results
+
+
+def run(args):
+    results = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        "encoding_load": {},
+        "matching": {},
+        "attendance_write": {},
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for roster_size in args.roster_sizes:
+            results["encoding_load"][str(roster_size)] = bench_encoding_load(work_dir, roster_size, args.repeat)
+            results["matching"][str(roster_size)] = bench_matching(roster_size, args.repeat)
+            for history_days in args.history_days:
+                key = f"{roster_size}x{history_days}"
+                results["attendance_write"][key] = bench_attendance_write(
+                    work_dir, roster_size, history_days, args.repeat)
+
+    if not args.skip_recognition:
+        results["recognition"] = bench_recognition(args.photo_dir, args.repeat)
+    return results
+
+
+def flatten(results, prefix=""):
+    # {"matching": {"50": {"median": ...}}} -> {"matching/50": median}
+    flat = {}
+    for key, value in results.items():
+        if key == "meta" or not isinstance(value, dict):
+            continue
+        if "median" in value:
+            flat[prefix + key] = value["median"]
+        else:
+            flat.update(flatten(value, f"{prefix}{key}/"))
+    return flat
+
+
+def compare(baseline, current, tolerance):
+    # Prints every timing that is more than `tolerance` slower than the
+    # baseline; returns the number of regressions
+    base = flatten(baseline)
+    regressions = 0
+    for key, value in sorted(flatten(current).items()):
+        if key not in base or base[key] <= 0:
+            continue
+        ratio = value / base[key]
+        marker = ""
+        if ratio > 1 + tolerance:
+            marker = "  REGRESSION"
+            regressions += 1
+        print(f"{key:45s} {base[key] * 1000:10.3f} ms -> {value * 1000:10.3f} ms  x{ratio:5.2f}{marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recognition and storage hot paths.")
+    parser.add_argument("--roster-sizes", type=int, nargs="+", default=ROSTER_SIZES)
+    parser.add_argument("--history-days", type=int, nargs="+", default=HISTORY_DAYS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--photo-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--skip-recognition", action="store_true",
+                        help="Skip the face_recognition stages (decode, detection, encoding)")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown before a timing counts as a regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, results, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
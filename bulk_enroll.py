@@ -0,0 +1,147 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from config import STUDENT_COLUMNS
+from instrumentation import StageTimer
+from recognition import encode_reference_photo
+
+PHOTO_COLUMN = "Photo Path"
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Several reference photos for one student are separated by ";" in a
+# manifest, and named <scholar_no>_<n>.jpg in a folder
+PHOTO_SEPARATOR = ";"
+
+
+class BulkEnrollmentReport:
+    def __init__(self):
+        self.enrolled = []
+        self.failures = []
+
+    def fail(self, row, scholar_no, reason):
+        self.failures.append((row, scholar_no, reason))
+
+    def summary(self):
+        lines = [f"Enrolled {len(self.enrolled)} students, {len(self.failures)} failed."]
+        for row, scholar_no, reason in self.failures:
+            lines.append(f"Row {row} ({scholar_no}): {reason}")
+        return "\n".join(lines)
+
+
+def read_manifest(manifest_file):
+    # Manifest columns are those of students.csv plus "Photo Path"; relative
+    # photo paths are resolved against the manifest's folder. Each row's
+    # "Photo Path" becomes a list of paths.
+    manifest_df = pd.read_csv(manifest_file, dtype=str).fillna("")
+    missing = [column for column in STUDENT_COLUMNS + [PHOTO_COLUMN] if column not in manifest_df.columns]
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(missing)}")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    rows = manifest_df[STUDENT_COLUMNS + [PHOTO_COLUMN]].to_dict('records')
+    for row in rows:
+        row[PHOTO_COLUMN] = [
+            os.path.join(base_dir, path.strip())
+            for path in row[PHOTO_COLUMN].split(PHOTO_SEPARATOR) if path.strip()
+        ]
+    return rows
+
+
+def read_photo_directory(directory, branch, semester):
+    # A folder of <scholar_no>.jpg photos for one branch and semester, with
+    # optional extra photos named <scholar_no>_2.jpg, <scholar_no>_3.jpg, ...
+    # A name like 2021_0457.jpg only counts as an extra photo when 2021.jpg
+    # (in any photo format) is there too, since scholar numbers may contain
+    # underscores. Names and emails are left blank and can be filled in later.
+    photos = [
+        (os.path.splitext(file_name)[0], file_name)
+        for file_name in sorted(os.listdir(directory))
+        if os.path.splitext(file_name)[1].lower() in PHOTO_EXTENSIONS
+    ]
+    stems = {stem for stem, _ in photos}
+
+    rows = {}
+    for stem, file_name in photos:
+        scholar_no, _, suffix = stem.rpartition("_")
+        if not (scholar_no in stems and suffix.isdigit()):
+            scholar_no = stem
+        row = rows.setdefault(scholar_no, {
+            "Student Name": "",
+            "Scholar No": scholar_no,
+            "Branch": branch,
+            "Semester": semester,
+            "Email ID": "",
+            PHOTO_COLUMN: [],
+        })
+        row[PHOTO_COLUMN].append(os.path.join(directory, file_name))
+    return list(rows.values())
+
+
+def bulk_enroll(rows, student_file, face_store, max_workers=None, metrics=None):
+    timer = metrics or StageTimer()
+    report = BulkEnrollmentReport()
+    students_df = pd.read_csv(student_file)
+    existing = set(students_df['Scholar No'].astype(str))
+
+    # Validate every row before doing any face work; rows are numbered as in
+    # the manifest (header is row 1)
+    candidates = []
+    seen = set()
+    for row_number, row in enumerate(rows, start=2):
+        scholar_no = str(row["Scholar No"]).strip()
+        if not all(str(row[column]).strip() for column in ("Scholar No", "Branch", "Semester")):
+            report.fail(row_number, scholar_no, "Scholar No, Branch and Semester are required.")
+        elif scholar_no in existing:
+            report.fail(row_number, scholar_no, "Scholar No already exists.")
+        elif scholar_no in seen:
+            report.fail(row_number, scholar_no, "Duplicate Scholar No in manifest.")
+        elif not row[PHOTO_COLUMN]:
+            report.fail(row_number, scholar_no, "No photo given.")
+        elif any(not os.path.isfile(photo) for photo in row[PHOTO_COLUMN]):
+            missing = [photo for photo in row[PHOTO_COLUMN] if not os.path.isfile(photo)]
+            report.fail(row_number, scholar_no, f"Photo not found: {', '.join(missing)}")
+        else:
+            seen.add(scholar_no)
+            candidates.append((row_number, scholar_no, row))
+
+    if not candidates:
+        return report
+
+    # Encode every reference photo across a process pool. A student is only
+    # enrolled if all of their photos encode.
+    n_photos = sum(len(row[PHOTO_COLUMN]) for _, _, row in candidates)
+    workers = max_workers or min(n_photos, os.cpu_count() or 1)
+    with timer.stage("encoding"), ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            [pool.submit(encode_reference_photo, photo) for photo in row[PHOTO_COLUMN]]
+            for _, _, row in candidates
+        ]
+
+        new_students = []
+        new_faces = []
+        for (row_number, scholar_no, row), photo_futures in zip(candidates, futures):
+            try:
+                encodings = [future.result() for future in photo_futures]
+            except Exception as e:
+                report.fail(row_number, scholar_no, str(e))
+                continue
+            new_students.append([str(row[column]).strip() for column in STUDENT_COLUMNS])
+            new_faces.extend((scholar_no, encoding) for encoding in encodings)
+            report.enrolled.append(scholar_no)
+
+    if not new_faces:
+        return report
+
+    # Write everything in one go. Faces go first: a face without a student
+    # row is ignored by matching, while the reverse would enroll a student
+    # who can never be recognised.
+    with timer.stage("write"):
+        face_store.add_many(new_faces)
+        students_df = pd.concat([students_df, pd.DataFrame(new_students, columns=STUDENT_COLUMNS)],
+                                ignore_index=True)
+        temp_file = f"{student_file}.tmp"
+        students_df.to_csv(temp_file, index=False)
+        os.replace(temp_file, student_file)
+
+    return report
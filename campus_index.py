@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+from matching import face_distance_matrix
+
+# Below this many rows a brute-force scan is already fast enough
+EXACT_LIMIT = 5000
+KMEANS_ITERATIONS = 10
+
+
+def kmeans(matrix, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].astype(np.float64)
+    for _ in range(iterations):
+        assignments = nearest_centroids(matrix, centroids)
+        for cluster in range(n_clusters):
+            members = matrix[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters so every list stays useful
+                centroids[cluster] = matrix[rng.integers(len(matrix))]
+    return centroids
+
+
+def nearest_centroids(matrix, centroids, chunk_size=8192):
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), chunk_size):
+        chunk = np.asarray(matrix[start:start + chunk_size])
+        assignments[start:start + chunk_size] = face_distance_matrix(chunk, centroids).argmin(axis=1)
+    return assignments
+
+
+class CampusIndex:
+    # Nearest-neighbour search over every enrolled encoding, used to identify
+    # faces the subject's roster didn't match (students in the wrong section,
+    # visitors from other branches). Small stores are scanned exactly; larger
+    # ones use an IVF layout: the encodings are clustered around sqrt(n)
+    # centroids and a query only scans the rows of its `nprobe` nearest
+    # clusters. The face store is append-only, so new enrollments are just
+    # assigned to their nearest centroid; the clustering is retrained once
+    # the store has doubled since it was built.
+
+    def __init__(self, face_store, index_file="faces.ivf.npz", nprobe=8):
+        self.face_store = face_store
+        self.index_file = index_file
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self._lists = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with np.load(self.index_file) as data:
+                self.centroids = data['centroids']
+                self.assignments = data['assignments']
+                self.trained_rows = int(data['trained_rows'])
+        except (OSError, ValueError, KeyError):
+            self.centroids = None
+
+    def _save(self):
+        self._lists = None
+        temp_file = f"{self.index_file}.tmp"
+        with open(temp_file, 'wb') as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments,
+                     trained_rows=self.trained_rows)
+        os.replace(temp_file, self.index_file)
+
+    def sync(self):
+        # Bring the index up to date with rows appended to the face store
+        _, matrix = self.face_store.all_rows()
+        n_rows = len(matrix)
+        if n_rows < EXACT_LIMIT:
+            return
+
+        if self.centroids is None or len(self.assignments) > n_rows or n_rows > 2 * self.trained_rows:
+            self.centroids = kmeans(matrix, int(np.sqrt(n_rows)))
+            self.assignments = nearest_centroids(matrix, self.centroids)
+            self.trained_rows = n_rows
+        elif len(self.assignments) < n_rows:
+            new_rows = nearest_centroids(matrix[len(self.assignments):], self.centroids)
+            self.assignments = np.concatenate([self.assignments, new_rows])
+        else:
+            return
+        self._save()
+
+    def _inverted_lists(self):
+        # Rows sorted by cluster, plus where each cluster's run starts
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            offsets = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def _candidate_rows(self, encoding, n_rows):
+        if self.centroids is None or n_rows < EXACT_LIMIT:
+            return np.arange(n_rows)
+        centroid_distances = face_distance_matrix(self.centroids, encoding[None, :])[:, 0]
+        probes = np.argsort(centroid_distances)[:self.nprobe]
+        order, offsets = self._inverted_lists()
+        return np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes]))
+
+    def search(self, encodings, k=5, exclude=()):
+        # Top-k (scholar no, distance) pairs for each encoding, skipping
+        # scholar numbers in `exclude`. A student with several references
+        # appears once, at their closest reference.
+        self.sync()
+        scholars, matrix = self.face_store.all_rows()
+        exclude = {str(scholar) for scholar in exclude}
+
+        results = []
+        for encoding in np.asarray(encodings, dtype=np.float64).reshape(-1, 128):
+            rows = self._candidate_rows(encoding, len(matrix))
+            if exclude:
+                rows = rows[[scholars[row] not in exclude for row in rows]]
+            if not len(rows):
+                results.append([])
+                continue
+
+            distances = face_distance_matrix(matrix[rows], encoding[None, :])[:, 0]
+            matches = []
+            seen = set()
+            for i in np.argsort(distances):
+                scholar = scholars[rows[i]]
+                if scholar not in seen:
+                    seen.add(scholar)
+                    matches.append((scholar, float(distances[i])))
+                    if len(matches) == k:
+                        break
+            results.append(matches)
+        return results
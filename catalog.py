@@ -0,0 +1,96 @@
+import os
+
+import pandas as pd
+
+from config import subject_csv_file
+from attendance_store import subject_key
+from subject_settings import SETTING_DEFAULTS, row_settings
+
+
+class CachedCsv:
+    # A CSV file parsed once and handed out from memory until the file's
+    # modification time or size changes. `build` turns the DataFrame into
+    # whatever indexed structure the caller wants.
+
+    def __init__(self, path, build=None):
+        self.path = path
+        self.build = build
+        self._signature = None
+        self._value = None
+
+    def get(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            df = pd.read_csv(self.path)
+            self._value = self.build(df) if self.build else df
+            self._signature = signature
+        return self._value
+
+
+class Students:
+    # students.csv with hash lookups by scholar number and by class
+    def __init__(self, df):
+        self.df = df
+        self.by_scholar = {str(scholar_no): row for row, scholar_no in enumerate(df['Scholar No'])}
+        self.by_class = {}
+        for row, key in enumerate(zip(df['Branch'].astype(str), df['Semester'].astype(str))):
+            self.by_class.setdefault(key, []).append(row)
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, scholar_no):
+        return str(scholar_no).strip() in self.by_scholar
+
+    def in_class(self, branch, semester):
+        # Students of one branch and semester, compared exactly as entered
+        return self.df.iloc[self.by_class.get((str(branch), str(semester)), [])]
+
+
+class Subjects:
+    # subjects.csv keyed like the subject CSV files (lower-cased)
+    def __init__(self, df):
+        self.df = df
+        self.by_key = {
+            subject_key(subject, branch, semester): row
+            for row, (subject, branch, semester) in enumerate(zip(df['Subject'], df['Branch'], df['Semester']))
+        }
+        self.labels = [
+            f"{subject}({branch}-{semester})"
+            for subject, branch, semester in zip(df['Subject'], df['Branch'], df['Semester'])
+        ]
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, key):
+        return subject_key(*key) in self.by_key
+
+    def settings(self, subject, branch, semester):
+        row = self.by_key.get(subject_key(subject, branch, semester))
+        return dict(SETTING_DEFAULTS) if row is None else row_settings(self.df.iloc[row])
+
+
+class Catalog:
+    # Students, subjects and subject rosters kept in memory for the app and
+    # the recognition service. Each file is re-read only after it changes on
+    # disk, whoever changed it.
+
+    def __init__(self, student_file, subject_file):
+        self._students = CachedCsv(student_file, Students)
+        self._subjects = CachedCsv(subject_file, Subjects)
+        self._rosters = {}
+
+    def students(self):
+        return self._students.get()
+
+    def subjects(self):
+        return self._subjects.get()
+
+    def roster(self, subject, branch, semester):
+        # Scholar numbers on a subject's roster
+        path = subject_csv_file(subject, branch, semester)
+        if path not in self._rosters:
+            self._rosters[path] = CachedCsv(path, lambda df: df['Scholar No'].tolist())
+        return self._rosters[path].get()
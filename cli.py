@@ -0,0 +1,315 @@
+import os
+import sys
+import csv
+import argparse
+import threading
+
+import config
+
+# Only the standard library and config are imported at module level. Each
+# subcommand imports what it needs, so listing subjects never loads pandas
+# and only `mark` / `enroll` load face_recognition.
+
+
+def open_face_store():
+    from face_store import FaceStore
+    face_store = FaceStore(config.ENCODING_FILE, config.ENCODING_INDEX_FILE)
+    face_store.setup()
+    face_store.migrate_from_csv(config.FACE_FILE)
+    return face_store
+
+
+def open_attendance_store():
+    from attendance_store import AttendanceStore
+    attendance_store = AttendanceStore(config.ATTENDANCE_DB)
+    attendance_store.setup()
+    return attendance_store
+
+
+def read_subjects():
+    with open(config.SUBJECT_FILE, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def find_subject(subject, branch, semester):
+    for row in read_subjects():
+        if (row["Subject"].lower() == subject.lower() and row["Branch"].lower() == branch.lower()
+                and row["Semester"] == str(semester)):
+            return row
+    raise SystemExit(f"Unknown subject: {subject} ({branch}-{semester})")
+
+
+def cmd_subjects(args):
+    for row in read_subjects():
+        print(f"{row['Subject']}({row['Branch']}-{row['Semester']})")
+    return 0
+
+
+def cmd_mark(args):
+    if args.service:
+        return mark_with_service(args)
+
+    import pandas as pd
+    from attendance import mark_attendance, merge_late_photos, identify_unmatched, load_roster
+    from campus_index import CampusIndex
+    from encoding_cache import EncodingCache
+    from pipeline import run_photo_pool, PipelineCancelled
+    from video import VIDEO_DETECTION
+    from subject_settings import subject_settings
+    from instrumentation import RunMetrics
+
+    find_subject(args.subject, args.branch, args.semester)
+    missing = [photo for photo in args.photos if not os.path.isfile(photo)]
+    if missing:
+        raise SystemExit(f"Photo not found: {', '.join(missing)}")
+
+    settings = subject_settings(pd.read_csv(config.SUBJECT_FILE), args.subject, args.branch, args.semester)
+    detection = args.detection or settings["Detection"]
+    tolerance = args.tolerance if args.tolerance is not None else settings["Tolerance"]
+
+    # Late photos go into an existing session; find it before encoding anything
+    attendance_store = open_attendance_store()
+    session_id = args.session
+    if args.late:
+        session_id = attendance_store.latest_session(args.subject, args.branch, args.semester, args.date)
+        if session_id is None:
+            raise SystemExit(f"No session on {args.date or 'today'} to add the photos to.")
+
+    cache = EncodingCache(config.CACHE_DIR)
+    cache.setup()
+    metrics = RunMetrics("attendance", subject=f"{args.subject}-{args.branch}-{args.semester}".lower(),
+                         detection=detection)
+
+    def on_progress(done, total, photo_path, photo_result):
+        print(f"[{done}/{total}] {photo_path}: {len(photo_result[0])} faces", file=sys.stderr)
+
+    cancel_event = threading.Event()
+    try:
+        photo_results = run_photo_pool(args.photos, on_progress=on_progress, cancel_event=cancel_event,
+                                       max_workers=args.workers, detection=detection, cache=cache,
+                                       metrics=metrics, video_detection=args.detection or VIDEO_DETECTION)
+    except (KeyboardInterrupt, PipelineCancelled):
+        cancel_event.set()
+        print("Cancelled; no attendance written.", file=sys.stderr)
+        return 130
+
+    face_store = open_face_store()
+    if session_id:
+        try:
+            newly_present, result = merge_late_photos(session_id, photo_results, face_store, attendance_store,
+                                                      tolerance, metrics=metrics, learn=args.learn_references)
+        except KeyError as e:
+            raise SystemExit(e.args[0])
+        attendance = attendance_store.session_attendance(session_id)
+        print(f"Session {session_id}: {len(newly_present)} more present, "
+              f"{sum(attendance.values())} of {len(attendance)} in total")
+    else:
+        session_id, result = mark_attendance(args.subject, args.branch, args.semester, photo_results,
+                                             face_store, attendance_store, tolerance, args.date,
+                                             metrics=metrics, learn=args.learn_references)
+        print(f"Session {session_id}: {len(result.present)} of {len(result.scholars)} students present")
+
+    # Faces the roster didn't match, looked up across every enrolled student
+    with metrics.stage("campus_lookup"):
+        campus_index = CampusIndex(face_store, config.CAMPUS_INDEX_FILE)
+        roster = load_roster(args.subject, args.branch, args.semester)
+        unknown_faces = identify_unmatched(result, photo_results, campus_index, roster, k=args.top_k)
+    metrics.write(config.METRICS_FILE)
+
+    for photo_index, box, matches in unknown_faces:
+        found = ", ".join(f"{scholar} ({distance:.2f})" for scholar, distance in matches) or "no enrolled match"
+        print(f"Unmatched face in {args.photos[photo_index]} at {box}: {found}")
+    return 0
+
+
+def mark_with_service(args):
+    from service import ServiceClient, ServiceError
+
+    find_subject(args.subject, args.branch, args.semester)
+    try:
+        response = ServiceClient().mark(args.subject, args.branch, args.semester, args.photos, date=args.date,
+                                        tolerance=args.tolerance, detection=args.detection,
+                                        top_k=args.top_k, learn=args.learn_references,
+                                        session=args.session, late=args.late)
+    except (OSError, ServiceError) as e:
+        raise SystemExit(f"Recognition service: {e}")
+
+    if "newly_present" in response:
+        print(f"Session {response['session_id']}: {len(response['newly_present'])} more present, "
+              f"{len(response['present'])} of {response['total']} in total")
+    else:
+        print(f"Session {response['session_id']}: {len(response['present'])} of {response['total']} students present")
+    for photo_index, box, matches in response["unmatched"]:
+        found = ", ".join(f"{scholar} ({distance:.2f})" for scholar, distance in matches) or "no enrolled match"
+        print(f"Unmatched face in {args.photos[photo_index]} at {tuple(box)}: {found}")
+    return 0
+
+
+def cmd_serve(args):
+    import asyncio
+    from service import serve
+
+    def on_ready(service):
+        host, port = service.address
+        print(f"Recognition service listening on {host}:{port} with {service.max_workers} workers",
+              file=sys.stderr)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, on_ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_enroll(args):
+    from bulk_enroll import bulk_enroll, read_manifest, read_photo_directory
+    from campus_index import CampusIndex
+    from instrumentation import RunMetrics
+
+    if args.manifest:
+        rows = read_manifest(args.manifest)
+    else:
+        if not (args.branch and args.semester):
+            raise SystemExit("--folder needs --branch and --semester")
+        rows = read_photo_directory(args.folder, args.branch, args.semester)
+
+    metrics = RunMetrics("bulk_enrollment", rows=len(rows))
+    face_store = open_face_store()
+    report = bulk_enroll(rows, config.STUDENT_FILE, face_store, max_workers=args.workers,
+                         metrics=metrics)
+    CampusIndex(face_store, config.CAMPUS_INDEX_FILE).sync()
+    metrics.write(config.METRICS_FILE)
+    print(report.summary())
+    return 1 if report.failures else 0
+
+
+def cmd_detention(args):
+    import pandas as pd
+    from detention import DetentionEngine
+
+    engine = DetentionEngine(open_attendance_store())
+    subjects_df = pd.read_csv(config.SUBJECT_FILE)
+    if args.rebuild:
+        engine.rebuild(subjects_df)
+    else:
+        engine.import_subject_csvs(subjects_df)
+
+    report_df = engine.report(pd.read_csv(config.STUDENT_FILE), args.threshold, args.branch, args.semester)
+    report_df.to_csv(args.output, index=False)
+    print(engine.summary(report_df, args.threshold))
+    print(f"Saved to {args.output}")
+    return 0
+
+
+def cmd_export(args):
+    from attendance import load_roster
+
+    find_subject(args.subject, args.branch, args.semester)
+    attendance_store = open_attendance_store()
+    roster_file = config.subject_csv_file(args.subject, args.branch, args.semester)
+    attendance_store.import_wide_csv(args.subject, args.branch, args.semester, roster_file)
+
+    wide_df = attendance_store.export_wide(args.subject, args.branch, args.semester,
+                                           load_roster(args.subject, args.branch, args.semester))
+    output = args.output or f"{args.subject}-{args.branch}-{args.semester}-attendance.csv".lower()
+    wide_df.to_csv(output, index=False)
+    print(f"Attendance exported to {output}")
+    return 0
+
+
+def cmd_metrics(args):
+    from instrumentation import summarize
+
+    if not os.path.exists(config.METRICS_FILE):
+        raise SystemExit(f"No metrics recorded yet ({config.METRICS_FILE}).")
+
+    print(f"{'stage':24s} {'count':>6s} {'p50 ms':>10s} {'p90 ms':>10s} {'p99 ms':>10s}")
+    for name, stats in sorted(summarize(config.METRICS_FILE, args.run).items()):
+        print(f"{name:24s} {stats['count']:6d} {stats['p50'] * 1000:10.1f} "
+              f"{stats['p90'] * 1000:10.1f} {stats['p99'] * 1000:10.1f}")
+    return 0
+
+
+def add_subject_arguments(parser):
+    parser.add_argument("--subject", required=True)
+    parser.add_argument("--branch", required=True)
+    parser.add_argument("--semester", required=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="attenda", description="Attend-A without the GUI.")
+    parser.add_argument("--profile", metavar="FILE", help="Write a cProfile dump of this run to FILE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    subjects = commands.add_parser("subjects", help="List subjects")
+    subjects.set_defaults(func=cmd_subjects)
+
+    mark = commands.add_parser("mark", help="Mark attendance from class photos")
+    add_subject_arguments(mark)
+    mark.add_argument("photos", nargs="+")
+    mark.add_argument("--date", help="Session date (YYYY-MM-DD), defaults to today")
+    mark.add_argument("--tolerance", type=float, help="Override the subject's match tolerance")
+    mark.add_argument("--detection", choices=["fast", "balanced", "accurate", "tiled"],
+                      help="Override the subject's detection mode")
+    mark.add_argument("--workers", type=int, help="Worker processes (default: one per photo, up to the CPU count)")
+    mark.add_argument("--top-k", type=int, default=3,
+                      help="Campus-wide candidates to show for each face not on the roster")
+    mark.add_argument("--learn-references", action="store_true",
+                      help="Keep confident matches as extra reference encodings")
+    late = mark.add_mutually_exclusive_group()
+    late.add_argument("--late", action="store_true",
+                      help="Add the photos to the latest session on --date instead of starting a new one")
+    late.add_argument("--session", help="Add the photos to this session id")
+    mark.add_argument("--service", action="store_true",
+                      help="Send the photos to a running recognition service (see 'serve')")
+    mark.set_defaults(func=cmd_mark)
+
+    enroll = commands.add_parser("enroll", help="Bulk-enroll students")
+    source = enroll.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV with the students.csv columns plus 'Photo Path' "
+                                           "(several photos separated by ';')")
+    source.add_argument("--folder", help="Folder of <scholar_no>.jpg photos (extra ones as <scholar_no>_2.jpg, ... next to <scholar_no>.jpg)")
+    enroll.add_argument("--branch", help="Branch of the students in --folder")
+    enroll.add_argument("--semester", help="Semester of the students in --folder")
+    enroll.add_argument("--workers", type=int)
+    enroll.set_defaults(func=cmd_enroll)
+
+    detention = commands.add_parser("detention", help="Write the detention list")
+    detention.add_argument("--threshold", type=float, default=75.0, help="Minimum attendance percentage")
+    detention.add_argument("--branch")
+    detention.add_argument("--semester")
+    detention.add_argument("--rebuild", action="store_true", help="Recompute all attendance counters first")
+    detention.add_argument("--output", default=config.DETENTION_FILE)
+    detention.set_defaults(func=cmd_detention)
+
+    export = commands.add_parser("export", help="Export a subject's attendance as a spreadsheet")
+    add_subject_arguments(export)
+    export.add_argument("--output")
+    export.set_defaults(func=cmd_export)
+
+    serve = commands.add_parser("serve", help="Run the shared recognition service on this machine")
+    serve.add_argument("--host", default=config.SERVICE_HOST)
+    serve.add_argument("--port", type=int, default=config.SERVICE_PORT)
+    serve.add_argument("--workers", type=int, help="Worker processes (default: the CPU count)")
+    serve.set_defaults(func=cmd_serve)
+
+    metrics = commands.add_parser("metrics", help="Latency percentiles of recorded runs")
+    metrics.add_argument("--run", choices=["attendance", "enrollment", "bulk_enrollment"])
+    metrics.set_defaults(func=cmd_metrics)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config.setup_csv_files()
+    if not args.profile:
+        return args.func(args)
+
+    from instrumentation import profiled
+    with profiled(args.profile):
+        return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
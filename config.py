@@ -0,0 +1,35 @@
+import os
+import csv
+
+# Data files, relative to the working directory. Shared by the Kivy app and
+# the command line, and kept free of heavy imports so the CLI starts fast.
+STUDENT_FILE = "students.csv"
+SUBJECT_FILE = "subjects.csv"
+FACE_FILE = "faces.csv"
+ENCODING_FILE = "faces.bin"
+ENCODING_INDEX_FILE = "faces.idx"
+CAMPUS_INDEX_FILE = "faces.ivf.npz"
+CACHE_DIR = ".face_cache"
+ATTENDANCE_DB = "attendance.db"
+DETENTION_FILE = "detention-list.csv"
+METRICS_FILE = "metrics.jsonl"
+
+# Recognition service (service.py); only reachable from this machine
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+
+STUDENT_COLUMNS = ["Student Name", "Scholar No", "Branch", "Semester", "Email ID"]
+SUBJECT_COLUMNS = ["Subject", "Branch", "Semester"]
+
+
+def setup_csv_files():
+    # Create students.csv and subjects.csv with just their headers
+    for path, columns in ((STUDENT_FILE, STUDENT_COLUMNS), (SUBJECT_FILE, SUBJECT_COLUMNS)):
+        if not os.path.exists(path):
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerow(columns)
+
+
+def subject_csv_file(subject, branch, semester):
+    # Roster file of a subject, named like the spinner's lower-cased codes
+    return f"{subject}-{branch}-{semester}.csv".lower()
@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+
+from config import subject_csv_file
+
+DEFAULT_THRESHOLD = 75.0
+
+
+class DetentionEngine:
+    # Answers "who is below X% in any subject" from the running counters in
+    # the attendance store, so no session history has to be re-read
+
+    def __init__(self, attendance_store):
+        self.attendance_store = attendance_store
+
+    def import_subject_csvs(self, subjects_df):
+        # Pick up date columns of old subject CSVs not yet in the store
+        for subject, branch, semester in zip(subjects_df["Subject"], subjects_df["Branch"], subjects_df["Semester"]):
+            roster_file = subject_csv_file(subject, branch, semester)
+            if os.path.exists(roster_file):
+                self.attendance_store.import_wide_csv(subject, branch, semester, roster_file)
+
+    def rebuild(self, subjects_df):
+        # Recompute every counter from scratch
+        self.import_subject_csvs(subjects_df)
+        self.attendance_store.rebuild_counters()
+
+    def below_threshold(self, threshold=DEFAULT_THRESHOLD, branch=None, semester=None):
+        query = (
+            "SELECT scholar_no, subject, branch, semester, attended, held, "
+            "100.0 * attended / held AS percentage "
+            "FROM counters WHERE held > 0 AND 100.0 * attended < ? * held"
+        )
+        params = [float(threshold)]
+        if branch is not None:
+            query += " AND branch = ?"
+            params.append(str(branch).strip().lower())
+        if semester is not None:
+            query += " AND semester = ?"
+            params.append(str(semester).strip())
+        query += " ORDER BY branch, semester, subject, percentage"
+
+        with self.attendance_store.connect() as connection:
+            return pd.read_sql_query(query, connection, params=params)
+
+    def report(self, students_df, threshold=DEFAULT_THRESHOLD, branch=None, semester=None):
+        # Detention list with student names, grouped by branch and semester
+        detained = self.below_threshold(threshold, branch, semester)
+        names = students_df[["Scholar No", "Student Name"]].copy()
+        names["Scholar No"] = names["Scholar No"].astype(str)
+        detained = detained.merge(names, how="left", left_on="scholar_no", right_on="Scholar No")
+
+        report_df = pd.DataFrame({
+            "Branch": detained["branch"],
+            "Semester": detained["semester"],
+            "Scholar No": detained["scholar_no"],
+            "Student Name": detained["Student Name"],
+            "Subject": detained["subject"],
+            "Attended": detained["attended"],
+            "Held": detained["held"],
+            "Percentage": detained["percentage"].round(2),
+        })
+        return report_df.sort_values(["Branch", "Semester", "Scholar No", "Subject"], ignore_index=True)
+
+    def summary(self, report_df, threshold=DEFAULT_THRESHOLD):
+        if report_df.empty:
+            return f"No students below {threshold:g}% attendance."
+        lines = [f"Students below {threshold:g}% attendance:"]
+        for (branch, semester), group in report_df.groupby(["Branch", "Semester"]):
+            lines.append(f"{branch.upper()} Semester {semester}: {group['Scholar No'].nunique()} students")
+        return "\n".join(lines)
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from recognition import detection_params
+
+# Bump when the cached format or the detection/encoding code changes in a way
+# that makes old entries wrong
+CACHE_VERSION = 2
+
+
+def photo_digest(photo_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(photo_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EncodingCache:
+    # On-disk cache of face boxes and encodings per photo. Entries are keyed
+    # by the photo's content hash plus the detection parameters, so a renamed
+    # or copied photo still hits and a different detection mode does not.
+    # The directory is kept under max_bytes by evicting the least recently
+    # used entries.
+
+    def __init__(self, directory=".face_cache", max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def setup(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, photo_path, detection):
+        params = json.dumps(detection_params(detection), sort_keys=True)
+        key = hashlib.sha256(f"{CACHE_VERSION}:{photo_digest(photo_path)}:{params}".encode())
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                locations = [tuple(int(v) for v in box) for box in data['locations']]
+                encodings = data['encodings']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return locations, encodings
+
+    def put(self, key, result):
+        self.setup()
+        locations, encodings = result
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, locations=np.asarray(locations, dtype=np.int64).reshape(-1, 4),
+                     encodings=np.asarray(encodings, dtype=np.float64).reshape(-1, 128))
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        # Drop the least recently used entries until the cache fits
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,289 @@
+import os
+import json
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+ENCODING_SIZE = 128
+ENCODING_DTYPE = np.float32
+
+# Matching compares against at most this many vectors per student; students
+# with more reference encodings have them clustered down to this many
+PROTOTYPES_PER_STUDENT = 3
+KMEANS_ITERATIONS = 10
+
+
+def cluster_prototypes(references, k=PROTOTYPES_PER_STUDENT, iterations=KMEANS_ITERATIONS):
+    # Plain k-means seeded with the k references farthest apart, so a
+    # student's distinct looks (glasses, beard, lighting) each keep a centre
+    references = np.asarray(references, dtype=np.float64)
+    if len(references) <= k:
+        return references
+
+    seeds = [0]
+    distances = np.linalg.norm(references - references[0], axis=1)
+    while len(seeds) < k:
+        seeds.append(int(distances.argmax()))
+        distances = np.minimum(distances, np.linalg.norm(references - references[seeds[-1]], axis=1))
+    centroids = references[seeds].copy()
+
+    for _ in range(iterations):
+        assignments = np.linalg.norm(references[:, None, :] - centroids[None, :, :], axis=2).argmin(axis=1)
+        for cluster in range(k):
+            members = references[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return centroids
+
+
+class FaceStore:
+    # Face encodings are kept in one contiguous float32 matrix (one row per
+    # reference photo) next to a plain-text index holding the scholar number
+    # of each row. Both files are append-only, so enrolling a student never
+    # rewrites what is already on disk, and the matrix is memory mapped so
+    # opening the store does not parse anything. A student may have several
+    # reference rows; matching uses their prototypes (see get_prototypes),
+    # which are cached in a small sidecar file.
+    ROW_BYTES = ENCODING_SIZE * np.dtype(ENCODING_DTYPE).itemsize
+
+    def __init__(self, matrix_file="faces.bin", index_file="faces.idx", prototype_file=None):
+        self.matrix_file = matrix_file
+        self.index_file = index_file
+        self.prototype_file = prototype_file or f"{os.path.splitext(matrix_file)[0]}.proto.npz"
+        self._matrix = None
+        self._scholars = None
+        self._rows = None
+        self._prototypes = None
+        self._index_size = None
+
+    def setup(self):
+        for path in (self.matrix_file, self.index_file):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+    def _load(self):
+        if self._scholars is not None:
+            return
+
+        self.setup()
+        self._index_size = os.path.getsize(self.index_file)
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            scholars = [line.rstrip('\n') for line in f if line.strip()]
+
+        # A crash between the two writes of an append can leave a matrix row
+        # without an index entry; only rows present in both files count
+        n_rows = min(len(scholars), os.path.getsize(self.matrix_file) // self.ROW_BYTES)
+        self._scholars = scholars[:n_rows]
+
+        # Every row of a scholar is one of their reference encodings
+        self._rows = {}
+        for row, scholar in enumerate(self._scholars):
+            self._rows.setdefault(scholar, []).append(row)
+
+        if n_rows:
+            self._matrix = np.memmap(self.matrix_file, dtype=ENCODING_DTYPE, mode='r',
+                                     shape=(n_rows, ENCODING_SIZE))
+        else:
+            self._matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+
+    @contextmanager
+    def _locked(self):
+        # Exclusive lock across processes (the app, the CLI and the
+        # recognition service all append), held on a sidecar lock file
+        with open(f"{self.index_file}.lock", 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _invalidate(self):
+        # Drop the mapping so the next read picks up appended rows
+        self._matrix = None
+        self._scholars = None
+        self._rows = None
+
+    def refresh(self):
+        # Pick up rows another process has appended since the store was
+        # loaded; a no-op while the index file is unchanged
+        if self._scholars is not None and os.path.getsize(self.index_file) != self._index_size:
+            self._invalidate()
+
+    def __len__(self):
+        self._load()
+        return len(self._rows)
+
+    def __contains__(self, scholar_no):
+        self._load()
+        return str(scholar_no) in self._rows
+
+    def scholar_numbers(self):
+        self._load()
+        return list(self._rows)
+
+    def reference_count(self, scholar_no):
+        self._load()
+        return len(self._rows.get(str(scholar_no), ()))
+
+    def add(self, scholar_no, encoding):
+        self.add_many([(scholar_no, encoding)])
+
+    def add_many(self, entries):
+        entries = list(entries)
+        if not entries:
+            return
+
+        scholars = [str(scholar_no) for scholar_no, _ in entries]
+        matrix = np.asarray([encoding for _, encoding in entries], dtype=ENCODING_DTYPE)
+        if matrix.shape[1:] != (ENCODING_SIZE,):
+            raise ValueError(f"Face encodings must have {ENCODING_SIZE} values.")
+
+        self.setup()
+        self._invalidate()
+        with self._locked():
+            # Append after what is on disk now, not what this instance last
+            # loaded: another process may have appended since
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                lines = [line.rstrip('\n') for line in f if line.strip()]
+            n_rows = min(len(lines), os.path.getsize(self.matrix_file) // self.ROW_BYTES)
+
+            # Write the rows first and the index last, so a reader never sees
+            # an index entry whose encoding is missing
+            with open(self.matrix_file, 'r+b') as f:
+                f.seek(n_rows * self.ROW_BYTES)
+                f.write(matrix.tobytes())
+                f.truncate()
+
+            with open(self.index_file, 'r+', encoding='utf-8') as f:
+                if len(lines) != n_rows:
+                    # Drop index entries left behind by an interrupted append
+                    f.seek(0)
+                    f.truncate()
+                    f.write(''.join(line + '\n' for line in lines[:n_rows]))
+                else:
+                    f.seek(0, os.SEEK_END)
+                f.write(''.join(scholar + '\n' for scholar in scholars))
+
+    def get_encodings(self, scholar_numbers):
+        # Returns the scholar numbers that have an encoding together with
+        # their newest reference rows, gathered in one indexing operation
+        self._load()
+        found = []
+        rows = []
+        for scholar_no in scholar_numbers:
+            scholar_rows = self._rows.get(str(scholar_no))
+            if scholar_rows:
+                found.append(scholar_no)
+                rows.append(scholar_rows[-1])
+
+        if not rows:
+            return found, np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+        return found, np.asarray(self._matrix[np.asarray(rows)])
+
+    def all_rows(self):
+        # Every reference row with its scholar number
+        self._load()
+        return self._scholars, self._matrix
+
+    def _load_prototypes(self):
+        # scholar -> (reference count, prototypes); an entry is stale once the
+        # scholar has gained references since it was computed
+        if self._prototypes is not None:
+            return
+        self._prototypes = {}
+        try:
+            # Each data[...] access reads the array from the archive again
+            with np.load(self.prototype_file) as data:
+                scholars, counts = data['scholars'].tolist(), data['counts'].tolist()
+                offsets, matrix = data['offsets'].tolist(), data['matrix']
+        except (OSError, ValueError, KeyError):
+            return
+        for scholar, count, start, stop in zip(scholars, counts, offsets[:-1], offsets[1:]):
+            self._prototypes[str(scholar)] = (count, matrix[start:stop])
+
+    def _save_prototypes(self):
+        scholars = list(self._prototypes)
+        blocks = [self._prototypes[scholar][1] for scholar in scholars]
+        offsets = np.cumsum([0] + [len(block) for block in blocks])
+        temp_file = f"{self.prototype_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'wb') as f:
+            np.savez(f, scholars=np.asarray(scholars, dtype=str),
+                     counts=np.asarray([self._prototypes[s][0] for s in scholars], dtype=np.int64),
+                     offsets=offsets, matrix=np.concatenate(blocks).astype(ENCODING_DTYPE))
+        os.replace(temp_file, self.prototype_file)
+
+    def get_prototypes(self, scholar_numbers, k=PROTOTYPES_PER_STUDENT):
+        # Like get_encodings, but returns up to k vectors per scholar: their
+        # references as-is when they have k or fewer, otherwise k cluster
+        # centres. Rows are grouped by scholar; offsets[i] is where the i-th
+        # found scholar's block starts.
+        self._load()
+        self._load_prototypes()
+        found = []
+        blocks = []
+        plain_rows = []
+        changed = False
+        for scholar_no in scholar_numbers:
+            scholar_rows = self._rows.get(str(scholar_no))
+            if not scholar_rows:
+                continue
+            found.append(scholar_no)
+            if len(scholar_rows) <= k:
+                # Filled in below from a single gather of all such rows
+                blocks.append(len(scholar_rows))
+                plain_rows.extend(scholar_rows)
+                continue
+
+            cached = self._prototypes.get(str(scholar_no))
+            if cached is None or cached[0] != len(scholar_rows) or len(cached[1]) != k:
+                prototypes = cluster_prototypes(self._matrix[np.asarray(scholar_rows)], k)
+                cached = (len(scholar_rows), prototypes.astype(ENCODING_DTYPE))
+                self._prototypes[str(scholar_no)] = cached
+                changed = True
+            blocks.append(cached[1])
+
+        if changed:
+            self._save_prototypes()
+
+        if plain_rows:
+            gathered = np.asarray(self._matrix[np.asarray(plain_rows)])
+            start = 0
+            for index, block in enumerate(blocks):
+                if isinstance(block, int):
+                    blocks[index] = gathered[start:start + block]
+                    start += block
+
+        if not blocks:
+            return found, np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE), np.zeros(0, dtype=np.int64)
+        offsets = np.cumsum([0] + [len(block) for block in blocks[:-1]])
+        return found, np.concatenate(blocks), offsets
+
+    def migrate_from_csv(self, csv_file):
+        # One-shot import of the old faces.csv (stringified 128-float lists).
+        # Only runs while the store is still empty.
+        if len(self) or not os.path.exists(csv_file):
+            return 0
+
+        faces_df = pd.read_csv(csv_file)
+        entries = [
+            (scholar_no, json.loads(encoding))
+            for scholar_no, encoding in zip(faces_df['Scholar No'], faces_df['Face Encoding'])
+        ]
+        self.add_many(entries)
+        return len(entries)
@@ -0,0 +1,132 @@
+import sys
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out
+    resource = None
+
+
+def peak_rss_mb():
+    # Highest RSS of this process so far. Pool workers are reused, so in a
+    # worker this covers every job it has run, not just the current one.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+class StageTimer:
+    # Wall and CPU time per named stage; a stage entered twice accumulates
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            stage["wall"] += time.perf_counter() - wall_start
+            stage["cpu"] += time.process_time() - cpu_start
+
+
+class RunMetrics(StageTimer):
+    # Metrics for one attendance or enrollment run, written as one JSON line.
+    # Per-photo stages come back from the worker processes through add_photo.
+
+    def __init__(self, run, **context):
+        super().__init__()
+        self.run = run
+        self.context = context
+        self.photos = []
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def add_photo(self, photo_path, faces, stages, peak_rss=None, cached=False):
+        # peak_rss is the peak_rss_mb() of the worker that encoded the photo,
+        # as it stood when the photo was done
+        self.photos.append({
+            "photo": photo_path,
+            "faces": faces,
+            "cached": cached,
+            "stages": stages,
+            "worker_peak_rss_mb": peak_rss,
+        })
+
+    def record(self):
+        return {
+            "run": self.run,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            **self.context,
+            "wall": time.perf_counter() - self.started,
+            "cpu": time.process_time() - self.cpu_started,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+            "photos": self.photos,
+        }
+
+    def write(self, metrics_file):
+        with open(metrics_file, 'a') as f:
+            f.write(json.dumps(self.record()) + "\n")
+
+
+@contextmanager
+def profiled(profile_file):
+    # Dump a cProfile of the enclosed block to profile_file (no-op if None)
+    if not profile_file:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(metrics_file, run=None):
+    # Wall-time percentiles per stage across every logged run. Photo stages
+    # are prefixed with "photo/".
+    samples = {}
+    with open(metrics_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if run and record["run"] != run:
+                continue
+            samples.setdefault("total", []).append(record["wall"])
+            for name, stage in record["stages"].items():
+                samples.setdefault(name, []).append(stage["wall"])
+            for photo in record["photos"]:
+                for name, stage in photo["stages"].items():
+                    samples.setdefault(f"photo/{name}", []).append(stage["wall"])
+
+    return {
+        name: {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p90": percentile(values, 0.9),
+            "p99": percentile(values, 0.99),
+        }
+        for name, values in samples.items()
+    }
@@ -1,20 +1,44 @@
 import os
-from datetime import datetime
+import re
+import threading
 import pandas as pd
-import face_recognition
+import config
+from face_store import FaceStore
+from attendance import mark_attendance, merge_late_photos, identify_unmatched
+from campus_index import CampusIndex
+from instrumentation import RunMetrics
+from subject_settings import parse_setting, SETTING_DEFAULTS, SETTING_CHOICES
+from catalog import Catalog
+from pipeline import PhotoPipeline
+from recognition import encode_reference_photo
+from encoding_cache import EncodingCache
+from bulk_enroll import bulk_enroll, read_manifest, read_photo_directory
+from attendance_store import AttendanceStore
+from detention import DetentionEngine, DEFAULT_THRESHOLD
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.spinner import Spinner
 from kivy.uix.textinput import TextInput
 from kivy.uix.popup import Popup
+from kivy.uix.progressbar import ProgressBar
 from kivy.uix.filechooser import FileChooserListView
 
 class AttendanceSystemApp(App):
-    STUDENT_FILE = "students.csv"
-    SUBJECT_FILE = "subjects.csv"
-    FACE_FILE = "faces.csv"
+    STUDENT_FILE = config.STUDENT_FILE
+    SUBJECT_FILE = config.SUBJECT_FILE
+    FACE_FILE = config.FACE_FILE
+    ENCODING_FILE = config.ENCODING_FILE
+    ENCODING_INDEX_FILE = config.ENCODING_INDEX_FILE
+    CACHE_DIR = config.CACHE_DIR
+    ATTENDANCE_DB = config.ATTENDANCE_DB
+    DETENTION_FILE = config.DETENTION_FILE
+    METRICS_FILE = config.METRICS_FILE
+    CAMPUS_INDEX_FILE = config.CAMPUS_INDEX_FILE
+    # Keep confident matches from class photos as extra reference encodings
+    LEARN_REFERENCES = True
 
     def build(self):
         self.setup_files()
@@ -35,6 +59,13 @@ class AttendanceSystemApp(App):
         detention_button.bind(on_press=self.release_detention_list)
         self.root.add_widget(detention_button)
 
+        export_button = Button(
+            text='Export Attendance',
+            size_hint=(1, 0.2)
+        )
+        export_button.bind(on_press=self.export_attendance)
+        self.root.add_widget(export_button)
+
         enroll_button = Button(
             text='Enroll Students',
             size_hint=(1, 0.2)
@@ -42,41 +73,53 @@ class AttendanceSystemApp(App):
         enroll_button.bind(on_press=self.enroll_students)
         self.root.add_widget(enroll_button)
 
+        bulk_enroll_button = Button(
+            text='Bulk Enroll Students',
+            size_hint=(1, 0.2)
+        )
+        bulk_enroll_button.bind(on_press=self.show_bulk_enrollment_popup)
+        self.root.add_widget(bulk_enroll_button)
+
         return self.root
 
     def setup_files(self):
-        # Check and create students.csv
-        if not os.path.exists(self.STUDENT_FILE):
-            student_columns = ["Student Name", "Scholar No", "Branch", "Semester", "Email ID"]
-            pd.DataFrame(columns=student_columns).to_csv(self.STUDENT_FILE, index=False)
+        # Check and create students.csv and subjects.csv
+        config.setup_csv_files()
+        # Students, subjects and rosters, re-read only when the files change
+        self.catalog = Catalog(self.STUDENT_FILE, self.SUBJECT_FILE)
+
+        # Open the binary face store, importing faces.csv on first run
+        self.face_store = FaceStore(self.ENCODING_FILE, self.ENCODING_INDEX_FILE)
+        self.face_store.setup()
+        self.face_store.migrate_from_csv(self.FACE_FILE)
 
-        # Check and create subjects.csv
-        if not os.path.exists(self.SUBJECT_FILE):
-            subject_columns = ["Subject", "Branch", "Semester"]
-            pd.DataFrame(columns=subject_columns).to_csv(self.SUBJECT_FILE, index=False)
+        # Campus-wide index for faces that aren't on a subject's roster
+        self.campus_index = CampusIndex(self.face_store, self.CAMPUS_INDEX_FILE)
 
-        # Check and create faces.csv
-        if not os.path.exists(self.FACE_FILE):
-            face_columns = ["Scholar No", "Face Encoding"]
-            pd.DataFrame(columns=face_columns).to_csv(self.FACE_FILE, index=False)
+        # Open the attendance database
+        self.attendance_store = AttendanceStore(self.ATTENDANCE_DB)
+        self.attendance_store.setup()
+        self.detention_engine = DetentionEngine(self.attendance_store)
+
+        # Cache of per-photo detections so re-runs skip encoding
+        self.encoding_cache = EncodingCache(self.CACHE_DIR)
+        self.encoding_cache.setup()
 
     def mark_attendance(self, instance):
         # Check if students.csv is empty
-        students_df = pd.read_csv(self.STUDENT_FILE)
-        if students_df.empty:
+        if not len(self.catalog.students()):
             self.show_popup("Error", "Enroll students first.")
             return
 
         # Check if subjects.csv is empty
-        subjects_df = pd.read_csv(self.SUBJECT_FILE)
-        if subjects_df.empty:
-            self.prompt_subject_details(students_df)
+        if not len(self.catalog.subjects()):
+            self.prompt_subject_details()
             return
 
         # If subjects exist, let the user choose
-        self.choose_existing_or_new_subject(subjects_df, students_df)
+        self.choose_existing_or_new_subject()
 
-    def prompt_subject_details(self, students_df):
+    def prompt_subject_details(self):
         # Prompt user to enter subject, branch, and semester
         popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
 
@@ -104,6 +147,26 @@ class AttendanceSystemApp(App):
         semester_layout.add_widget(semester_input)
         popup_layout.add_widget(semester_layout)
 
+        # Match tolerance input (optional)
+        tolerance_layout = BoxLayout(orientation='horizontal')
+        tolerance_label = Label(text='Tolerance:', size_hint=(0.3, 1))
+        tolerance_input = TextInput(multiline=False, size_hint=(0.7, 1), hint_text='0.5')
+        tolerance_layout.add_widget(tolerance_label)
+        tolerance_layout.add_widget(tolerance_input)
+        popup_layout.add_widget(tolerance_layout)
+
+        # Detection speed/recall mode
+        detection_layout = BoxLayout(orientation='horizontal')
+        detection_label = Label(text='Detection:', size_hint=(0.3, 1))
+        detection_spinner = Spinner(
+            text=SETTING_DEFAULTS["Detection"],
+            values=SETTING_CHOICES["Detection"],
+            size_hint=(0.7, 1)
+        )
+        detection_layout.add_widget(detection_label)
+        detection_layout.add_widget(detection_spinner)
+        popup_layout.add_widget(detection_layout)
+
         # Submit button
         submit_button = Button(text='Submit', size_hint=(1, 0.2))
         popup_layout.add_widget(submit_button)
@@ -120,29 +183,33 @@ class AttendanceSystemApp(App):
                 self.show_popup("Error", "Please fill in all fields.")
                 return
 
+            try:
+                tolerance = parse_setting("Tolerance", tolerance_input.text)
+                detection = parse_setting("Detection", detection_spinner.text)
+            except ValueError as e:
+                self.show_popup("Error", str(e))
+                return
+
             # Check if branch-semester pair exists in students.csv
-            filtered_students = students_df[
-                (students_df['Branch'].astype(str) == str(branch)) & (students_df['Semester'].astype(str) == str(semester))
-            ]
+            filtered_students = self.catalog.students().in_class(branch, semester)
             if filtered_students.empty:
                 self.show_popup("Error", f"No students found for {branch} Semester {semester}.")
             else:
-                # Read existing subjects from subjects.csv
-                subjects_df = pd.read_csv(self.SUBJECT_FILE)
+                subjects = self.catalog.subjects()
 
-                # Check for duplicate subject-branch-semester
-                if ((subjects_df["Subject"].astype(str) == str(subject)) &
-                    (subjects_df["Branch"].astype(str) == str(branch)) &
-                    (subjects_df["Semester"].astype(str) == str(semester))).any():
+                # Check for duplicate subject-branch-semester; subject files are
+                # named in lower case, so the check ignores case too
+                if (subject, branch, semester) in subjects:
                     self.show_popup("Error", f"The subject '{subject}' for {branch} Semester {semester} already exists.")
                 else:
                     # Add new subject to subjects.csv
-                    new_subject = pd.DataFrame([[subject, branch, semester]], columns=["Subject", "Branch", "Semester"])
-                    subjects_df = pd.concat([subjects_df, new_subject], ignore_index=True)
+                    new_subject = pd.DataFrame([[subject, branch, semester, tolerance, detection]],
+                                               columns=["Subject", "Branch", "Semester", "Tolerance", "Detection"])
+                    subjects_df = pd.concat([subjects.df, new_subject], ignore_index=True)
                     subjects_df.to_csv(self.SUBJECT_FILE, index=False)
 
                     # Create subject file
-                    subject_file = f"{subject}-{branch}-{semester}.csv"
+                    subject_file = config.subject_csv_file(subject, branch, semester)
                     filtered_students[["Scholar No"]].to_csv(subject_file, index=False)
                     self.show_popup("Success", f"Subject '{subject}' added and attendance file created.")
 
@@ -152,7 +219,7 @@ class AttendanceSystemApp(App):
         submit_button.bind(on_press=on_submit)
         popup.open()
 
-    def choose_existing_or_new_subject(self, subjects_df, students_df):
+    def choose_existing_or_new_subject(self):
         # Popup to choose between existing or new subject
         popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
 
@@ -172,13 +239,9 @@ class AttendanceSystemApp(App):
             subject_popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
 
             # Spinner for existing subjects
-            spinner_values = [
-                f"{row['Subject']}({row['Branch']}-{row['Semester']})"
-                for _, row in subjects_df.iterrows()
-            ]
             subject_spinner = Spinner(
                 text="Select Subject",
-                values=spinner_values,
+                values=self.catalog.subjects().labels,
                 size_hint=(1, 0.2)
             )
             subject_popup_layout.add_widget(subject_spinner)
@@ -200,7 +263,7 @@ class AttendanceSystemApp(App):
                     self.show_popup("Error", "Select a subject first.")
                 else:
                     # Popup to accept the number of class photos
-                    def process_photos(photo_count):
+                    def process_photos(photo_count, late=False):
                         photos = []
 
                         # Collect photos one by one
@@ -224,57 +287,81 @@ class AttendanceSystemApp(App):
                                     photos.append(selected_files[0])
                                     photo_popup.dismiss()
                                     if len(photos) == photo_count:
-                                        process_attendance(photos)
+                                        process_attendance(photos, late)
 
                             upload_button.bind(on_press=on_file_selected)
                             photo_popup.open()
 
-                    def process_attendance(photos):
+                    def process_attendance(photos, late=False):
                         # Extract the subject's details from the spinner
-                        import re
-                        subject_details = subject_spinner.text
-                        match = re.match(r'(\w+)\((\w+)-(\d+)\)', subject_details)
-
-                        if match:
-                            subject_code = match.group(1).lower()     
-                            branch_code = match.group(2).lower()      
-                            semester = match.group(3).lower()         
-                            
-                            subject_csv_file = f"{subject_code}-{branch_code}-{semester}.csv"
-                        else:
-                            raise ValueError(f"Invalid subject format: {subject_details}")
-
-                        # Read the subject attendance CSV to fetch scholar numbers
-                        subject_df = pd.read_csv(subject_csv_file)
-                        scholar_numbers = subject_df['Scholar No'].tolist()
-
-                        # Read the faces.csv to fetch encodings for scholar numbers
-                        faces_df = pd.read_csv("faces.csv")
-                        known_encodings = {}
-                        for _, row in faces_df.iterrows():
-                            if row['Scholar No'] in scholar_numbers:
-                                known_encodings[row['Scholar No']] = eval(row['Face Encoding'])
-
-                        # Initialize a dictionary to mark attendance
-                        attendance = {scholar: 0 for scholar in scholar_numbers}
-
-                        # Process each photo
-                        for photo_path in photos:
-                            unknown_image = face_recognition.load_image_file(photo_path)
-                            unknown_encodings = face_recognition.face_encodings(unknown_image)
-
-                            for unknown_encoding in unknown_encodings:
-                                for scholar, known_encoding in known_encodings.items():
-                                    result = face_recognition.compare_faces([known_encoding], unknown_encoding, tolerance=0.5)
-                                    if result[0]:
-                                        attendance[scholar] = 1
-
-                        # Add attendance to the subject's CSV file
-                        today_date = datetime.now().strftime('%Y-%m-%d')
-                        subject_df[today_date] = subject_df['Scholar No'].apply(lambda x: attendance[x])
-                        subject_df.to_csv(subject_csv_file, index=False)
-
-                        self.show_popup("Success", "Attendance marked successfully.")
+                        subject_code, branch_code, semester = self.parse_subject_choice(subject_spinner.text)
+                        roster = self.catalog.roster(subject_code, branch_code, semester)
+
+                        # Late photos are merged into today's last session
+                        session_id = None
+                        if late:
+                            session_id = self.attendance_store.latest_session(subject_code, branch_code, semester)
+                            if session_id is None:
+                                self.show_popup("Error", "No session today to add the photos to.")
+                                return
+
+                        def on_progress(done, total, photo_path, photo_result):
+                            progress_bar.value = done
+                            status_label.text = f"Processed {done} of {total} photos ({os.path.basename(photo_path)})"
+
+                        def record(photo_results):
+                            # Matching, the database write and the campus lookup run
+                            # off the main thread; the CLI or the service may hold
+                            # attendance.db at the same time
+                            if session_id:
+                                # Match the absent students only and update the session
+                                newly_present, result = merge_late_photos(
+                                    session_id, photo_results, self.face_store, self.attendance_store,
+                                    settings["Tolerance"], metrics=metrics, learn=self.LEARN_REFERENCES)
+                                message = f"{len(newly_present)} more students marked present."
+                            else:
+                                # Match against the roster and append the session
+                                _, result = mark_attendance(subject_code, branch_code, semester, photo_results,
+                                                            self.face_store, self.attendance_store,
+                                                            settings["Tolerance"], metrics=metrics,
+                                                            learn=self.LEARN_REFERENCES, roster=roster)
+                                message = "Attendance marked successfully."
+
+                            # Look up faces the roster didn't match across the whole campus
+                            with metrics.stage("campus_lookup"):
+                                unknown_faces = identify_unmatched(result, photo_results, self.campus_index, roster)
+                            metrics.write(self.METRICS_FILE)
+
+                            others = [matches[0] for _, _, matches in unknown_faces if matches]
+                            if others:
+                                message += "\nAlso seen (not on this roster): " + ", ".join(
+                                    f"{scholar} ({distance:.2f})" for scholar, distance in others)
+                            return message
+
+                        def on_complete(photo_results):
+                            progress_popup.dismiss()
+                            self.run_in_background(
+                                lambda: record(photo_results),
+                                lambda message: self.show_popup("Success", message),
+                                lambda error: self.show_popup("Attendance Error", str(error)),
+                            )
+
+                        def on_error(error):
+                            progress_popup.dismiss()
+                            self.show_popup("Face Recognition Error", str(error))
+
+                        # Decode and encode the photos on a process pool; attendance
+                        # is only written once every photo has come back
+                        settings = self.catalog.subjects().settings(subject_code, branch_code, semester)
+                        metrics = RunMetrics("attendance", subject=f"{subject_code}-{branch_code}-{semester}",
+                                             detection=settings["Detection"])
+                        pipeline = PhotoPipeline(photos, on_progress=on_progress,
+                                                 on_complete=on_complete, on_error=on_error,
+                                                 detection=settings["Detection"],
+                                                 cache=self.encoding_cache, metrics=metrics)
+                        progress_popup, progress_bar, status_label = self.show_progress_popup(
+                            "Processing Photos", len(photos), pipeline.cancel)
+                        pipeline.start()
 
                     # New popup to accept the number of photos
                     num_photos_popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -284,6 +371,10 @@ class AttendanceSystemApp(App):
                     submit_button = Button(text="Submit", size_hint=(1, 0.2))
                     num_photos_popup_layout.add_widget(submit_button)
 
+                    # Photos taken after today's session was already marked
+                    late_button = Button(text="Add to Today's Last Session", size_hint=(1, 0.2))
+                    num_photos_popup_layout.add_widget(late_button)
+
                     num_photos_popup = Popup(
                         title="Enter Number of Photos",
                         content=num_photos_popup_layout,
@@ -295,13 +386,14 @@ class AttendanceSystemApp(App):
                             num_photos = int(num_photos_input.text)
                             if num_photos > 0:
                                 num_photos_popup.dismiss()
-                                process_photos(num_photos)
+                                process_photos(num_photos, late=instance is late_button)
                             else:
                                 self.show_popup("Error", "Enter a valid number of photos.")
                         except ValueError:
                             self.show_popup("Error", "Enter a valid number of photos.")
 
                     submit_button.bind(on_press=on_submit_photos)
+                    late_button.bind(on_press=on_submit_photos)
                     num_photos_popup.open()
 
 
@@ -311,14 +403,72 @@ class AttendanceSystemApp(App):
 
         def on_add_new_subject(instance):
             popup.dismiss()
-            self.prompt_subject_details(students_df)
+            self.prompt_subject_details()
 
         select_existing_button.bind(on_press=on_select_existing)
         add_subject_button.bind(on_press=on_add_new_subject)
         popup.open()
 
+    def parse_subject_choice(self, subject_details):
+        # Spinner entries look like "DSA(CSE-5)"
+        match = re.match(r'(\w+)\((\w+)-(\d+)\)', subject_details)
+        if not match:
+            raise ValueError(f"Invalid subject format: {subject_details}")
+        return match.group(1).lower(), match.group(2).lower(), match.group(3).lower()
+
+    def export_attendance(self, instance):
+        subjects = self.catalog.subjects()
+        if not len(subjects):
+            self.show_popup("Error", "Add a subject first.")
+            return
+
+        popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        subject_spinner = Spinner(
+            text="Select Subject",
+            values=subjects.labels,
+            size_hint=(1, 0.2)
+        )
+        popup_layout.add_widget(subject_spinner)
+        export_button = Button(text="Export", size_hint=(1, 0.2))
+        popup_layout.add_widget(export_button)
+
+        popup = Popup(title='Export Attendance', content=popup_layout, size_hint=(0.8, 0.6))
+
+        def on_export(instance):
+            if subject_spinner.text == "Select Subject":
+                self.show_popup("Error", "Select a subject first.")
+                return
+
+            # Write the spreadsheet layout: one row per student, one column per session
+            subject_code, branch_code, semester = self.parse_subject_choice(subject_spinner.text)
+            subject_csv_file = config.subject_csv_file(subject_code, branch_code, semester)
+            self.attendance_store.import_wide_csv(subject_code, branch_code, semester, subject_csv_file)
+            wide_df = self.attendance_store.export_wide(subject_code, branch_code, semester,
+                                                        self.catalog.roster(subject_code, branch_code, semester))
+            export_file = f"{subject_code}-{branch_code}-{semester}-attendance.csv"
+            wide_df.to_csv(export_file, index=False)
+
+            popup.dismiss()
+            self.show_popup("Success", f"Attendance exported to {export_file}.")
+
+        export_button.bind(on_press=on_export)
+        popup.open()
+
     def release_detention_list(self, instance):
-        self.show_popup('Release Detention List', 'This feature is under development.')
+        self.show_input_popup('Minimum Attendance % (default 75)', self.write_detention_list)
+
+    def write_detention_list(self, threshold_text):
+        try:
+            threshold = float(threshold_text) if threshold_text.strip() else DEFAULT_THRESHOLD
+        except ValueError:
+            self.show_popup("Error", "Enter a valid percentage.")
+            return
+
+        self.detention_engine.import_subject_csvs(self.catalog.subjects().df)
+        report_df = self.detention_engine.report(self.catalog.students().df, threshold)
+        report_df.to_csv(self.DETENTION_FILE, index=False)
+        self.show_popup('Release Detention List',
+                        f"{self.detention_engine.summary(report_df, threshold)}\nSaved to {self.DETENTION_FILE}.")
 
     def show_popup(self, title, message):
         popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
@@ -330,6 +480,37 @@ class AttendanceSystemApp(App):
         close_button.bind(on_press=popup.dismiss)
         popup.open()
 
+    def show_progress_popup(self, title, total, on_cancel):
+        popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        status_label = Label(text=f"Processed 0 of {total}")
+        popup_layout.add_widget(status_label)
+        progress_bar = ProgressBar(max=total, value=0, size_hint=(1, 0.2))
+        popup_layout.add_widget(progress_bar)
+        cancel_button = Button(text='Cancel', size_hint=(1, 0.2))
+        popup_layout.add_widget(cancel_button)
+
+        popup = Popup(title=title, content=popup_layout, size_hint=(0.8, 0.4), auto_dismiss=False)
+
+        def on_cancel_pressed(instance):
+            on_cancel()
+            popup.dismiss()
+
+        cancel_button.bind(on_press=on_cancel_pressed)
+        popup.open()
+        return popup, progress_bar, status_label
+
+    def run_in_background(self, work, on_complete, on_error):
+        # Run work() on a thread and report back on the Kivy main thread
+        def target():
+            try:
+                result = work()
+            except Exception as e:
+                Clock.schedule_once(lambda dt: on_error(e))
+            else:
+                Clock.schedule_once(lambda dt: on_complete(result))
+
+        threading.Thread(target=target, daemon=True).start()
+
     def show_input_popup(self, title, callback):
         popup_layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         input_box = TextInput(multiline=False, size_hint=(1, 0.2))
@@ -417,8 +598,7 @@ class AttendanceSystemApp(App):
             return
 
         # Check if Scholar No already exists
-        students_df = pd.read_csv(self.STUDENT_FILE)
-        if scholar_no in students_df['Scholar No'].values:
+        if scholar_no in self.catalog.students():
             # Scholar No exists, skip the enrollment
             self.enrollment_popup.dismiss()
             self.show_popup("Duplicate Scholar No", f"Scholar No {scholar_no} already exists.")
@@ -431,49 +611,111 @@ class AttendanceSystemApp(App):
     def capture_student_face(self, name, scholar_no, branch, semester, email):
         # Create a file chooser popup for face image
         content = BoxLayout(orientation='vertical')
-        file_chooser = FileChooserListView(path=os.path.expanduser("~"))
+        # Several photos (different angles, lighting) give better matches
+        file_chooser = FileChooserListView(path=os.path.expanduser("~"), multiselect=True)
         content.add_widget(file_chooser)
 
         # Select button
-        select_button = Button(text='Select Image', size_hint=(1, 0.2))
+        select_button = Button(text='Select Images', size_hint=(1, 0.2))
         content.add_widget(select_button)
 
         # Create popup
-        face_popup = Popup(title='Select Student Face Image', content=content, size_hint=(0.9, 0.9))
+        face_popup = Popup(title='Select Student Face Images', content=content, size_hint=(0.9, 0.9))
 
         def on_select(instance):
-            selected_file = file_chooser.selection and file_chooser.selection[0]
-            if selected_file:
+            selected_files = list(file_chooser.selection)
+            if selected_files:
                 face_popup.dismiss()
-                self.process_face_image(selected_file, name, scholar_no, branch, semester, email)
+                self.process_face_image(selected_files, name, scholar_no, branch, semester, email)
             else:
                 self.show_popup("Error", "No image selected.")
 
         select_button.bind(on_press=on_select)
         face_popup.open()
-    def process_face_image(self, face_image_path, name, scholar_no, branch, semester, email):
+    def show_bulk_enrollment_popup(self, instance):
+        # Pick a manifest CSV, or a folder of <scholar_no>.jpg photos together
+        # with the branch and semester they belong to
+        content = BoxLayout(orientation='vertical', spacing=10)
+        file_chooser = FileChooserListView(path=os.path.expanduser("~"), dirselect=True)
+        content.add_widget(file_chooser)
+
+        branch_input = TextInput(multiline=False, size_hint=(1, 0.1), hint_text='Branch (folder only)')
+        content.add_widget(branch_input)
+        semester_input = TextInput(multiline=False, size_hint=(1, 0.1), hint_text='Semester (folder only)')
+        content.add_widget(semester_input)
+
+        enroll_button = Button(text='Enroll', size_hint=(1, 0.1))
+        content.add_widget(enroll_button)
+
+        bulk_popup = Popup(title='Select Manifest or Photo Folder', content=content, size_hint=(0.9, 0.9))
+
+        def on_enroll(instance):
+            selected = file_chooser.selection and file_chooser.selection[0]
+            if not selected:
+                self.show_popup("Error", "Select a manifest or a folder.")
+                return
+
+            try:
+                if os.path.isdir(selected):
+                    branch = branch_input.text.strip()
+                    semester = semester_input.text.strip()
+                    if not all([branch, semester]):
+                        self.show_popup("Error", "Enter the branch and semester for the folder.")
+                        return
+                    rows = read_photo_directory(selected, branch, semester)
+                else:
+                    rows = read_manifest(selected)
+            except Exception as e:
+                self.show_popup("Error", str(e))
+                return
+
+            def enroll():
+                metrics = RunMetrics("bulk_enrollment", rows=len(rows))
+                report = bulk_enroll(rows, self.STUDENT_FILE, self.face_store, metrics=metrics)
+                self.campus_index.sync()
+                metrics.write(self.METRICS_FILE)
+                return report
+
+            bulk_popup.dismiss()
+            self.show_popup("Bulk Enrollment", f"Enrolling {len(rows)} students...")
+            self.run_in_background(
+                enroll,
+                lambda report: self.show_popup("Bulk Enrollment", report.summary()),
+                lambda error: self.show_popup("Bulk Enrollment Error", str(error)),
+            )
+
+        enroll_button.bind(on_press=on_enroll)
+        bulk_popup.open()
+
+    def process_face_image(self, face_image_paths, name, scholar_no, branch, semester, email):
+        metrics = RunMetrics("enrollment", scholar_no=scholar_no, photos=len(face_image_paths))
         try:
-            # Load and encode face
-            image = face_recognition.load_image_file(face_image_path)
-            face_encodings = face_recognition.face_encodings(image)
-
-            if not face_encodings:
-                raise ValueError("No face detected in the image.")
-
-            # Save student details
-            students_df = pd.read_csv(self.STUDENT_FILE)
-            new_student = pd.DataFrame([[name, scholar_no, branch, semester, email]], 
-                                        columns=students_df.columns)
-            students_df = pd.concat([students_df, new_student], ignore_index=True)
-            students_df.to_csv(self.STUDENT_FILE, index=False)
-
-            # Save face encoding
-            faces_df = pd.read_csv(self.FACE_FILE)
-            face_encoding = face_encodings[0].tolist()
-            new_face = pd.DataFrame([[scholar_no, face_encoding]], 
-                                     columns=faces_df.columns)
-            faces_df = pd.concat([faces_df, new_face], ignore_index=True)
-            faces_df.to_csv(self.FACE_FILE, index=False)
+            # Encode the face in every selected photo; each must show exactly
+            # one face, as in bulk enrollment
+            face_encodings = []
+            for face_image_path in face_image_paths:
+                with metrics.stage("encoding"):
+                    try:
+                        face_encodings.append(encode_reference_photo(face_image_path))
+                    except ValueError as e:
+                        raise ValueError(f"{os.path.basename(face_image_path)}: {e}")
+            metrics.context["faces"] = len(face_encodings)
+
+            with metrics.stage("write"):
+                # Each photo becomes one reference encoding in the face store.
+                # Faces go first: a face without a student row is ignored by
+                # matching, while the reverse would enroll a student who can
+                # never be recognised.
+                self.face_store.add_many((scholar_no, encoding) for encoding in face_encodings)
+
+                # Save student details
+                students_df = self.catalog.students().df
+                new_student = pd.DataFrame([[name, scholar_no, branch, semester, email]], 
+                                            columns=students_df.columns)
+                students_df = pd.concat([students_df, new_student], ignore_index=True)
+                students_df.to_csv(self.STUDENT_FILE, index=False)
+                self.campus_index.sync()
+            metrics.write(self.METRICS_FILE)
 
             # Show success popup
             self.show_popup("Enrollment Success", f"Student {name} enrolled successfully.")
@@ -0,0 +1,216 @@
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.5
+
+
+def face_distance_matrix(known_encodings, unknown_encodings):
+    # Euclidean distance between every known encoding (rows) and every
+    # detected encoding (columns), computed in one shot instead of one
+    # compare_faces call per pair
+    known = np.asarray(known_encodings, dtype=np.float64).reshape(-1, 128)
+    unknown = np.asarray(unknown_encodings, dtype=np.float64).reshape(-1, 128)
+
+    squared = (
+        np.einsum('ij,ij->i', known, known)[:, None]
+        + np.einsum('ij,ij->i', unknown, unknown)[None, :]
+        - 2.0 * known @ unknown.T
+    )
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+class MatchResult:
+    def __init__(self, scholars, distances, assigned_faces, tolerance, matched_faces=None):
+        self.scholars = list(scholars)
+        self.distances = distances
+        self.tolerance = tolerance
+
+        # Closest face assigned to each student (-1 when absent)
+        self.assigned_faces = assigned_faces
+
+        # Every face that was assigned to some student; a student seen in
+        # several photos has several matched faces but one assigned face
+        if matched_faces is None:
+            matched_faces = {int(face) for face in assigned_faces if face >= 0}
+        self.matched_faces = matched_faces
+
+        n_students, n_faces = distances.shape
+        if n_faces:
+            self.best_distances = distances.min(axis=1)
+        else:
+            self.best_distances = np.full(n_students, np.inf)
+
+        # Distance to the assigned face (nan when absent)
+        students = np.nonzero(assigned_faces >= 0)[0]
+        self.assigned_distances = np.full(n_students, np.nan)
+        self.assigned_distances[students] = distances[students, assigned_faces[students]]
+
+        # Margin: how much closer the assigned face is to this student than
+        # to the next-closest student. Small margins flag look-alikes.
+        self.margins = np.full(n_students, np.nan)
+        for student, face in enumerate(assigned_faces):
+            if face < 0:
+                continue
+            column = distances[:, face]
+            if n_students > 1:
+                runner_up = np.partition(np.delete(column, student), 0)[0]
+                self.margins[student] = runner_up - column[student]
+            else:
+                self.margins[student] = np.inf
+
+    @property
+    def present(self):
+        return {scholar for scholar, face in zip(self.scholars, self.assigned_faces) if face >= 0}
+
+    @property
+    def unmatched_faces(self):
+        return [face for face in range(self.distances.shape[1]) if face not in self.matched_faces]
+
+    def attendance(self):
+        present = self.present
+        return {scholar: int(scholar in present) for scholar in self.scholars}
+
+    def assigned_distance_map(self):
+        # scholar no -> distance to the assigned face, None when absent
+        return {
+            scholar: None if np.isnan(distance) else float(distance)
+            for scholar, distance in zip(self.scholars, self.assigned_distances.tolist())
+        }
+
+
+def solve_assignment(cost):
+    # Hungarian algorithm (shortest augmenting paths with potentials) for an
+    # n x m cost matrix with n <= m. Returns the column of each row in a
+    # minimum-cost assignment. The inner loop over columns is vectorised.
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=np.int64)  # 1-based row matched to each column, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for row in range(1, n + 1):
+        row_of[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = row_of[column]
+            free = ~used[1:]
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_column = int(candidates.argmin()) + 1
+            delta = candidates[next_column - 1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+
+            column = next_column
+            if row_of[column] == 0:
+                break
+
+        # Flip the augmenting path
+        while column:
+            previous = way[column]
+            row_of[column] = row_of[previous]
+            column = previous
+
+    columns = np.full(n, -1, dtype=np.int64)
+    matched = np.nonzero(row_of[1:])[0]
+    columns[row_of[1:][matched] - 1] = matched
+    return columns
+
+
+def connected_pairs(students, faces):
+    # Split the (student, face) candidate pairs into connected groups, so
+    # the assignment is solved on small independent blocks
+    parent = {}
+
+    def find(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for student, face in zip(students, faces):
+        parent[find(('s', student))] = find(('f', face))
+
+    groups = {}
+    for student, face in zip(students, faces):
+        groups.setdefault(find(('s', student)), []).append((student, face))
+    return list(groups.values())
+
+
+def assign_faces(distances, tolerance):
+    # One-to-one assignment of faces to students among the pairs within
+    # tolerance: as many students as possible are matched, and among those
+    # assignments the total distance is smallest. Each detected face marks
+    # at most one student, and a look-alike can't take a face when that
+    # would leave its owner unmatched.
+    n_students, n_faces = distances.shape
+    assigned_faces = np.full(n_students, -1, dtype=np.int64)
+    if not n_students or not n_faces:
+        return assigned_faces
+
+    students, faces = np.nonzero(distances <= tolerance)
+    for pairs in connected_pairs(students.tolist(), faces.tolist()):
+        rows = sorted({student for student, _ in pairs})
+        columns = sorted({face for _, face in pairs})
+        block = distances[np.ix_(rows, columns)]
+        allowed = block <= tolerance
+
+        # Every allowed pair is worth more than any difference in total
+        # distance, so the solver first maximises the number of matches
+        bonus = tolerance * min(block.shape) + 1.0
+        cost = np.where(allowed, block - bonus, 0.0)
+        transposed = len(rows) > len(columns)
+        solution = solve_assignment(cost.T if transposed else cost)
+
+        for i, j in enumerate(solution):
+            row, column = (j, i) if transposed else (i, j)
+            if j >= 0 and allowed[row, column]:
+                assigned_faces[rows[row]] = columns[column]
+    return assigned_faces
+
+
+def match_faces(scholars, known_encodings, unknown_encodings, tolerance=DEFAULT_TOLERANCE,
+                known_offsets=None):
+    # unknown_encodings is either one (n, 128) array for a single photo or a
+    # list with one array per photo. The whole batch is turned into a single
+    # distance matrix; the one-to-one assignment is then solved per photo,
+    # since the same student may legitimately appear in several photos.
+    #
+    # With known_offsets, known_encodings holds several prototypes per
+    # student in consecutive blocks (as returned by FaceStore.get_prototypes)
+    # and a student's distance to a face is that of their closest prototype.
+    if isinstance(unknown_encodings, (list, tuple)):
+        photos = [np.asarray(e, dtype=np.float64).reshape(-1, 128) for e in unknown_encodings]
+    else:
+        photos = [np.asarray(unknown_encodings, dtype=np.float64).reshape(-1, 128)]
+    unknown = np.vstack(photos) if photos else np.empty((0, 128))
+
+    distances = face_distance_matrix(known_encodings, unknown)
+    if known_offsets is not None and len(known_offsets):
+        distances = np.minimum.reduceat(distances, np.asarray(known_offsets), axis=0)
+    n_students = distances.shape[0]
+    assigned_faces = np.full(n_students, -1, dtype=np.int64)
+    matched_faces = set()
+
+    start = 0
+    for photo in photos:
+        stop = start + len(photo)
+        photo_faces = assign_faces(distances[:, start:stop], tolerance)
+        for student, face in enumerate(photo_faces):
+            if face < 0:
+                continue
+            face += start
+            matched_faces.add(int(face))
+            current = assigned_faces[student]
+            if current < 0 or distances[student, face] < distances[student, current]:
+                assigned_faces[student] = face
+        start = stop
+
+    return MatchResult(scholars, distances, assigned_faces, tolerance, matched_faces)
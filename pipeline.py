@@ -0,0 +1,200 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from recognition import encode_photo_timed, DEFAULT_DETECTION
+from tiles import is_tiled, prepare_tiles, encode_tile_timed, merge_tiles, combine_stages
+from video import encode_video_timed, is_video, detection_for, VIDEO_DETECTION
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class TiledPhoto:
+    # Tiles of one photo in flight through the pool
+    def __init__(self, plan, stages, peak_rss):
+        self.pixel_file, self.scale, self.shape, windows = plan
+        self.windows = windows
+        self.tile_results = [None] * len(windows)
+        self.stages = [stages]
+        self.peak_rss = peak_rss
+        self.remaining = len(windows)
+
+    def add(self, tile, result, stages, peak_rss):
+        # Returns True once every tile is in
+        self.tile_results[tile] = result
+        self.stages.append(stages)
+        if peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak_rss)
+        self.remaining -= 1
+        return not self.remaining
+
+
+def run_photo_pool(photos, on_progress=None, cancel_event=None, max_workers=None,
+                   detection=DEFAULT_DETECTION, cache=None, metrics=None, video_detection=VIDEO_DETECTION):
+    # Encode every photo on a process pool, one photo per worker. Results come
+    # back in the order of `photos`; on_progress(done, total, photo, result)
+    # fires as each photo finishes, in completion order. Photos found in the
+    # cache skip the pool entirely. Per-photo timings go to `metrics`.
+    # Videos are detected with `video_detection` rather than `detection`.
+    #
+    # In tiled detection mode a photo is decoded by one worker and its tiles
+    # are then spread over the whole pool; the photo completes when its last
+    # tile does.
+    results = [None] * len(photos)
+    done_count = 0
+
+    keys = [None] * len(photos)
+    to_encode = []
+    for index, photo in enumerate(photos):
+        if cache is not None:
+            started = time.perf_counter()
+            keys[index] = cache.key(photo, detection_for(photo, detection, video_detection))
+            results[index] = cache.get(keys[index])
+            if results[index] is not None and metrics is not None:
+                metrics.add_photo(photo, len(results[index][0]),
+                                  {"cache": {"wall": time.perf_counter() - started}}, cached=True)
+        if results[index] is None:
+            to_encode.append(index)
+        else:
+            done_count += 1
+            if on_progress:
+                on_progress(done_count, len(photos), photo, results[index])
+
+    if not to_encode:
+        return results
+
+    tiled = is_tiled(detection)
+    tile_dir = tempfile.mkdtemp(prefix="tiles-") if tiled else None
+    tiled_photos = {}
+
+    # Tiles keep every worker busy, even for a single photo
+    workers = max_workers or (os.cpu_count() or 1)
+    if not (max_workers or tiled):
+        workers = min(len(to_encode), workers)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    finished = False
+    try:
+        # pending maps each future to (photo index, tile number); the tile
+        # number is None for whole-photo jobs and -1 for a tiled photo's
+        # decode step
+        pending = {}
+        for index in to_encode:
+            if is_video(photos[index]):
+                pending[pool.submit(encode_video_timed, photos[index], video_detection)] = (index, None)
+            elif tiled:
+                pending[pool.submit(prepare_tiles, photos[index], detection, tile_dir)] = (index, -1)
+            else:
+                pending[pool.submit(encode_photo_timed, photos[index], detection)] = (index, None)
+
+        while pending:
+            # Wake up regularly so a cancel request is noticed even while a
+            # large photo is still being processed
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                raise PipelineCancelled()
+
+            for future in done:
+                index, tile = pending.pop(future)
+                result, stages, peak_rss = future.result()
+
+                if tile == -1:
+                    # Decoded: queue every tile of the photo
+                    tiled_photo = tiled_photos[index] = TiledPhoto(result, stages, peak_rss)
+                    for number, window in enumerate(tiled_photo.windows):
+                        future = pool.submit(encode_tile_timed, tiled_photo.pixel_file, window, detection)
+                        pending[future] = (index, number)
+                    continue
+
+                if tile is not None:
+                    tiled_photo = tiled_photos[index]
+                    if not tiled_photo.add(tile, result, stages, peak_rss):
+                        continue
+                    del tiled_photos[index]
+                    os.remove(tiled_photo.pixel_file)
+                    result = merge_tiles(tiled_photo.tile_results, tiled_photo.scale, tiled_photo.shape)
+                    stages = combine_stages(tiled_photo.stages)
+                    peak_rss = tiled_photo.peak_rss
+
+                results[index] = result
+                if metrics is not None:
+                    metrics.add_photo(photos[index], len(results[index][0]), stages, peak_rss)
+                if cache is not None:
+                    cache.put(keys[index], results[index])
+                done_count += 1
+                if on_progress:
+                    on_progress(done_count, len(photos), photos[index], results[index])
+        finished = True
+    finally:
+        # Don't block on photos still in flight when cancelling or failing,
+        # so an error is reported as soon as its photo fails
+        pool.shutdown(wait=finished, cancel_futures=True)
+        if tile_dir:
+            shutil.rmtree(tile_dir, ignore_errors=True)
+
+    return results
+
+
+class PhotoPipeline:
+    # Runs run_photo_pool on a background thread and hands progress, the final
+    # results and errors back to the Kivy main thread through Clock, so the UI
+    # stays responsive while photos are processed.
+
+    def __init__(self, photos, on_progress=None, on_complete=None, on_error=None, max_workers=None,
+                 detection=DEFAULT_DETECTION, cache=None, metrics=None, video_detection=VIDEO_DETECTION):
+        self.photos = list(photos)
+        self.detection = detection
+        self.video_detection = video_detection
+        self.cache = cache
+        self.metrics = metrics
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.max_workers = max_workers
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _run(self):
+        try:
+            results = run_photo_pool(
+                self.photos,
+                on_progress=self._report_progress,
+                cancel_event=self.cancel_event,
+                max_workers=self.max_workers,
+                detection=self.detection,
+                video_detection=self.video_detection,
+                cache=self.cache,
+                metrics=self.metrics,
+            )
+        except PipelineCancelled:
+            return
+        except Exception as e:
+            self._call_on_main_thread(self.on_error, e)
+            return
+
+        if not self.cancelled:
+            self._call_on_main_thread(self.on_complete, results)
+
+    def _report_progress(self, done, total, photo, result):
+        self._call_on_main_thread(self.on_progress, done, total, photo, result)
+
+    def _call_on_main_thread(self, callback, *args):
+        if callback is None:
+            return
+        from kivy.clock import Clock
+        Clock.schedule_once(lambda dt: callback(*args))
@@ -0,0 +1,174 @@
+import math
+
+import numpy as np
+
+# face_recognition (dlib) and PIL are imported inside the functions that use
+# them: they take seconds to load, and the presets below are needed by code
+# paths (settings, cache keys, the CLI) that never touch an image.
+
+# Speed/recall presets for detection. Faces are searched for on a copy of the
+# photo scaled down to `max_size` pixels on its longest side; the top
+# `back_row_fraction` of the frame, where the back rows sit and faces are
+# small, gets an extra pass upsampled `back_row_upsample` times.
+#
+# "tiled" is for panoramas: the photo is decoded at up to `decode_pixels`
+# pixels in total, whatever its aspect ratio, and detected in `tile_size`
+# tiles overlapping by `tile_overlap` (see tiles.py), so the back rows keep
+# their full resolution.
+DETECTION_PRESETS = {
+    "fast": {"max_size": 1024, "back_row_fraction": 0.0, "back_row_upsample": 0},
+    "balanced": {"max_size": 1600, "back_row_fraction": 0.4, "back_row_upsample": 2},
+    "accurate": {"max_size": 2400, "back_row_fraction": 0.5, "back_row_upsample": 2},
+    "tiled": {"max_size": 1600, "back_row_fraction": 0.0, "back_row_upsample": 0,
+              "decode_pixels": 24_000_000, "tile_size": 1600, "tile_overlap": 256},
+}
+DEFAULT_DETECTION = "balanced"
+
+# Photos are decoded to at most this many pixels on their longest side, and
+# faces are encoded at that resolution. It is well above what dlib's 150 px
+# face chips need even for the back rows, and caps a decoded photo at about
+# 30 MB of pixels however large the file is.
+MAX_DECODE_SIZE = 3200
+
+
+def detection_params(detection=DEFAULT_DETECTION):
+    if isinstance(detection, dict):
+        return dict(DETECTION_PRESETS[DEFAULT_DETECTION], **detection)
+    try:
+        return dict(DETECTION_PRESETS[str(detection).lower()])
+    except KeyError:
+        raise ValueError(f"Unknown detection mode: {detection}")
+
+
+def load_image(photo_path, max_size=MAX_DECODE_SIZE, max_pixels=None):
+    # Decode a photo as an upright RGB array no larger than max_size on its
+    # longest side and, with max_pixels, no more than that many pixels in
+    # total. JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8), so
+    # a 48 MP photo never exists at full size in memory; other formats are
+    # decoded in full and resized. Returns the array and its scale relative
+    # to the upright original.
+    from PIL import Image, ImageOps
+
+    with Image.open(photo_path) as image:
+        width, height = image.size
+        scale = min(1.0, max_size / max(width, height)) if max_size else 1.0
+        if max_pixels:
+            scale = min(scale, math.sqrt(max_pixels / (width * height)))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        # draft() picks the smallest DCT scale that still covers the
+        # requested size. Resizing happens before the EXIF rotation so that
+        # only the small copy is ever rotated.
+        if scale < 1.0:
+            image.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        if image.getexif().get(0x0112, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+        return np.asarray(image), scale
+
+
+def rescale_boxes(boxes, scale, height, width):
+    # Map (top, right, bottom, left) boxes found on a copy scaled by `scale`
+    # back to a height x width frame
+    return [
+        (
+            min(height, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale))),
+        )
+        for top, right, bottom, left in boxes
+    ]
+
+
+def downscale(image, scale):
+    if scale >= 1.0:
+        return image
+    from PIL import Image
+    height, width = image.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.asarray(Image.fromarray(image).resize(size, Image.BILINEAR))
+
+
+def box_overlap(a, b):
+    # Intersection over the smaller box, for (top, right, bottom, left) boxes.
+    # Using the smaller area catches a face found twice at different scales.
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    smaller = min((a[2] - a[0]) * (a[1] - a[3]), (b[2] - b[0]) * (b[1] - b[3]))
+    return intersection / smaller if smaller > 0 else 0.0
+
+
+def suppress_overlaps(boxes, threshold=0.5):
+    # Keep the larger of any two boxes that overlap by more than `threshold`
+    kept = []
+    for box in sorted(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]), reverse=True):
+        if all(box_overlap(box, other) <= threshold for other in kept):
+            kept.append(box)
+    return kept
+
+
+def detect_faces(image, detection=DEFAULT_DETECTION):
+    # Find face boxes on a downscaled copy and map them back to the full
+    # resolution frame
+    import face_recognition
+    params = detection_params(detection)
+    height, width = image.shape[:2]
+    max_size = params["max_size"]
+    scale = min(1.0, max_size / max(height, width)) if max_size else 1.0
+    small = downscale(image, scale)
+
+    boxes = list(face_recognition.face_locations(small))
+
+    # Upsampled pass restricted to the back rows
+    back_rows = int(small.shape[0] * params["back_row_fraction"])
+    if back_rows and params["back_row_upsample"]:
+        boxes += face_recognition.face_locations(
+            small[:back_rows], number_of_times_to_upsample=params["back_row_upsample"])
+        boxes = suppress_overlaps(boxes)
+
+    return rescale_boxes(boxes, scale, height, width)
+
+
+def encode_photo_timed(photo_path, detection=DEFAULT_DETECTION):
+    # Decode one class photo, find the faces and encode them. Runs inside a
+    # worker process, so it only takes and returns plain picklable values:
+    # ((locations, encodings), per-stage timings, peak RSS).
+    import face_recognition
+    from instrumentation import StageTimer, peak_rss_mb
+
+    timer = StageTimer()
+    with timer.stage("decode"):
+        image, scale = load_image(photo_path)
+    with timer.stage("detection"):
+        locations = detect_faces(image, detection)
+
+    # Landmarks and encodings are computed from the decoded pixels, but only
+    # inside the detected boxes
+    with timer.stage("encoding"):
+        encodings = face_recognition.face_encodings(image, locations)
+
+    # Boxes are reported in the coordinates of the upright original photo
+    height, width = (round(side / scale) for side in image.shape[:2])
+    result = (rescale_boxes(locations, scale, height, width),
+              np.asarray(encodings, dtype=np.float64).reshape(-1, 128))
+    return result, timer.stages, peak_rss_mb()
+
+
+def encode_reference_photo(photo_path):
+    # Encode a student's enrollment photo. Exactly one face must be visible,
+    # otherwise we can't tell whose encoding we are storing.
+    import face_recognition
+    image, _ = load_image(photo_path)
+    locations = face_recognition.face_locations(image)
+    if not locations:
+        raise ValueError("No face detected in the image.")
+    if len(locations) > 1:
+        raise ValueError(f"{len(locations)} faces detected in the image.")
+    return face_recognition.face_encodings(image, locations)[0]
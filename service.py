@@ -0,0 +1,390 @@
+import os
+import json
+import socket
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+
+# A long-running recognition service shared by every teacher on a machine.
+# The worker processes load the dlib models once and the face store stays
+# mapped, so a request only pays for its own photos. Clients speak one JSON
+# object per line over TCP on localhost (see ServiceClient).
+#
+# Photo jobs from all connections go through one queue. Whatever has queued
+# up while the workers were busy is sent to them together, split over the
+# idle workers, and identical photos (same content and detection mode) are
+# encoded once. Everything that touches the face store, the campus index or
+# the attendance database runs on a single writer thread, so writes from
+# concurrent requests never interleave.
+
+# Jobs arriving within BATCH_WINDOW seconds of each other are dispatched
+# together, at most BATCH_SIZE at a time
+BATCH_WINDOW = 0.02
+BATCH_SIZE = 32
+
+
+class ServiceError(Exception):
+    pass
+
+
+def warm_up():
+    # Pool initializer: importing face_recognition loads the dlib models, so
+    # each worker pays for that once instead of once per photo
+    import face_recognition  # noqa: F401
+
+
+def encode_batch(jobs):
+    # Worker side of a batch: encode (photo, detection) jobs in one round
+    # trip. Failures are returned per job so one bad photo doesn't fail the
+    # other requests sharing its batch.
+    from recognition import encode_photo_timed
+    from tiles import encode_tiled_timed, is_tiled
+    from video import encode_video_timed, is_video
+
+    results = []
+    for photo, detection in jobs:
+        try:
+            if is_video(photo):
+                encode = encode_video_timed
+            else:
+                encode = encode_tiled_timed if is_tiled(detection) else encode_photo_timed
+            results.append((True, encode(photo, detection)))
+        except Exception as e:
+            results.append((False, f"{os.path.basename(photo)}: {e}"))
+    return results
+
+
+class RecognitionService:
+    def __init__(self, max_workers=None, batch_window=BATCH_WINDOW, batch_size=BATCH_SIZE):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.pool = None
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.jobs = None
+        self.in_flight = {}
+        self.busy = 0
+        self.worker_free = None
+        self.dispatcher = None
+        self.server = None
+        self.photos_encoded = 0
+        self.batches = 0
+
+    def open_stores(self):
+        # Runs on the writer thread; heavy imports stay out of the event loop
+        from face_store import FaceStore
+        from campus_index import CampusIndex
+        from attendance_store import AttendanceStore
+        from encoding_cache import EncodingCache
+        from catalog import Catalog
+
+        config.setup_csv_files()
+        self.catalog = Catalog(config.STUDENT_FILE, config.SUBJECT_FILE)
+        self.face_store = FaceStore(config.ENCODING_FILE, config.ENCODING_INDEX_FILE)
+        self.face_store.setup()
+        self.face_store.migrate_from_csv(config.FACE_FILE)
+        self.campus_index = CampusIndex(self.face_store, config.CAMPUS_INDEX_FILE)
+        self.campus_index.sync()
+        self.attendance_store = AttendanceStore(config.ATTENDANCE_DB)
+        self.attendance_store.setup()
+        self.cache = EncodingCache(config.CACHE_DIR)
+        self.cache.setup()
+
+    async def start(self, host=config.SERVICE_HOST, port=config.SERVICE_PORT):
+        loop = asyncio.get_running_loop()
+        self.jobs = asyncio.Queue()
+        self.worker_free = asyncio.Condition()
+        await loop.run_in_executor(self.writer, self.open_stores)
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_up)
+        self.dispatcher = asyncio.create_task(self.dispatch())
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.writer.shutdown(wait=True)
+
+    @property
+    def address(self):
+        # (host, port) actually bound; useful when started with port 0
+        return self.server.sockets[0].getsockname()[:2]
+
+    # -- photo jobs --------------------------------------------------------
+
+    async def encode(self, photo, detection):
+        # (locations, encodings) of one photo, from an identical job already
+        # in flight, from the cache or from the worker pool. The lookup and
+        # registration of in-flight jobs must not await in between, or two
+        # requests for the same photo could both start a job; the cache is
+        # consulted by the job itself (see run_chunk).
+        key = (os.path.abspath(photo), detection)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            self.jobs.put_nowait((key, photo, detection, future))
+        # Shielded so one client going away doesn't cancel the job for the
+        # others waiting on it
+        return await asyncio.shield(future)
+
+    async def next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.jobs.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(await asyncio.wait_for(self.jobs.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def dispatch(self):
+        while True:
+            batch = await self.next_batch()
+            async with self.worker_free:
+                await self.worker_free.wait_for(lambda: self.busy < self.max_workers)
+                # Jobs that queued up while every worker was busy join this batch
+                while len(batch) < self.batch_size and not self.jobs.empty():
+                    batch.append(self.jobs.get_nowait())
+                idle = self.max_workers - self.busy
+                chunks = [batch[i::idle] for i in range(min(idle, len(batch)))]
+                self.busy += len(chunks)
+            self.batches += 1
+            for chunk in chunks:
+                asyncio.create_task(self.run_chunk(chunk))
+
+    def lookup_cache(self, chunk):
+        # (cache key, cached result or None) per job; hashing reads the whole
+        # photo, so this runs off the event loop. A photo that can't be read
+        # gets no key and fails in the worker with a proper message.
+        lookups = []
+        for _, photo, detection, _ in chunk:
+            try:
+                cache_key = self.cache.key(photo, detection)
+            except OSError:
+                lookups.append((None, None))
+                continue
+            lookups.append((cache_key, self.cache.get(cache_key)))
+        return lookups
+
+    async def run_chunk(self, chunk):
+        loop = asyncio.get_running_loop()
+        error = None
+        try:
+            misses = []
+            for job, (cache_key, cached) in zip(chunk, await loop.run_in_executor(None, self.lookup_cache, chunk)):
+                if cached is not None:
+                    job[3].set_result((cached, None))
+                else:
+                    misses.append((job, cache_key))
+
+            if misses:
+                try:
+                    results = await loop.run_in_executor(
+                        self.pool, encode_batch, [(photo, detection) for (_, photo, detection, _), _ in misses])
+                except Exception as e:
+                    results = [(False, str(e))] * len(misses)
+
+                to_cache = []
+                for ((_, _, _, future), cache_key), (ok, result) in zip(misses, results):
+                    if not ok:
+                        future.set_exception(ServiceError(result))
+                        continue
+                    photo_result, stages, peak_rss = result
+                    self.photos_encoded += 1
+                    future.set_result((photo_result, (stages, peak_rss)))
+                    if cache_key is not None:
+                        to_cache.append((cache_key, photo_result))
+
+                # Written before the jobs leave in_flight, so a repeat
+                # request finds either the job or the cache entry
+                for cache_key, photo_result in to_cache:
+                    try:
+                        await loop.run_in_executor(None, self.cache.put, cache_key, photo_result)
+                    except OSError:
+                        pass
+        except Exception as e:
+            error = e
+        finally:
+            # Every job leaves in_flight with an answer, whatever failed above
+            for key, photo, _, future in chunk:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+                if not future.done():
+                    future.set_exception(ServiceError(f"{os.path.basename(photo)}: {error or 'not encoded'}"))
+            async with self.worker_free:
+                self.busy -= 1
+                self.worker_free.notify()
+
+    # -- requests ----------------------------------------------------------
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line))
+                    response["ok"] = True
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request):
+        op = request.get("op")
+        if op == "status":
+            return {
+                "workers": self.max_workers,
+                "busy": self.busy,
+                "queued": self.jobs.qsize(),
+                "batches": self.batches,
+                "photos_encoded": self.photos_encoded,
+            }
+        if op == "mark":
+            return await self.mark(request)
+        raise ServiceError(f"Unknown request: {op}")
+
+    async def mark(self, request):
+        from video import detection_for, VIDEO_DETECTION
+
+        loop = asyncio.get_running_loop()
+        subject, branch, semester = request["subject"], request["branch"], str(request["semester"])
+        photos = request["photos"]
+        missing = [photo for photo in photos if not os.path.isfile(photo)]
+        if missing:
+            raise ServiceError(f"Photo not found: {', '.join(missing)}")
+
+        settings = await loop.run_in_executor(self.writer, self.subject_settings, subject, branch, semester)
+        detection = request.get("detection") or settings["Detection"]
+        video_detection = request.get("detection") or VIDEO_DETECTION
+        tolerance = request.get("tolerance")
+        tolerance = settings["Tolerance"] if tolerance is None else float(tolerance)
+
+        from instrumentation import RunMetrics
+        metrics = RunMetrics("attendance", subject=f"{subject}-{branch}-{semester}".lower(),
+                             detection=detection, service=True)
+        with metrics.stage("encoding"):
+            encoded = await asyncio.gather(
+                *(self.encode(photo, detection_for(photo, detection, video_detection)) for photo in photos))
+        for photo, (photo_result, timings) in zip(photos, encoded):
+            if timings is None:
+                metrics.add_photo(photo, len(photo_result[0]), {}, cached=True)
+            else:
+                metrics.add_photo(photo, len(photo_result[0]), *timings)
+
+        photo_results = [photo_result for photo_result, _ in encoded]
+        return await loop.run_in_executor(
+            self.writer, self.record, request, subject, branch, semester, photo_results, tolerance, metrics)
+
+    def subject_settings(self, subject, branch, semester):
+        if not os.path.exists(config.subject_csv_file(subject, branch, semester)):
+            raise ServiceError(f"Unknown subject: {subject} ({branch}-{semester})")
+        return self.catalog.subjects().settings(subject, branch, semester)
+
+    def record(self, request, subject, branch, semester, photo_results, tolerance, metrics):
+        # Writer thread: match, write (or merge into) the session and look up
+        # strangers
+        from attendance import mark_attendance, merge_late_photos, identify_unmatched
+
+        # Students may have been enrolled from another process meanwhile
+        self.face_store.refresh()
+        roster = self.catalog.roster(subject, branch, semester)
+        learn = bool(request.get("learn"))
+        session_id = request.get("session")
+        if request.get("late"):
+            session_id = self.attendance_store.latest_session(subject, branch, semester, request.get("date"))
+            if session_id is None:
+                raise ServiceError(f"No session on {request.get('date') or 'today'} to add the photos to.")
+
+        response = {}
+        if session_id:
+            try:
+                newly_present, result = merge_late_photos(session_id, photo_results, self.face_store,
+                                                          self.attendance_store, tolerance, metrics=metrics,
+                                                          learn=learn)
+            except KeyError as e:
+                raise ServiceError(e.args[0])
+            attendance = self.attendance_store.session_attendance(session_id)
+            present = [scholar for scholar, marked in attendance.items() if marked]
+            response["newly_present"] = sorted(str(scholar) for scholar in newly_present)
+        else:
+            session_id, result = mark_attendance(subject, branch, semester, photo_results, self.face_store,
+                                                 self.attendance_store, tolerance, request.get("date"),
+                                                 metrics=metrics, learn=learn, roster=roster)
+            present = result.present
+
+        with metrics.stage("campus_lookup"):
+            self.campus_index.sync()
+            unknown_faces = identify_unmatched(result, photo_results, self.campus_index, roster,
+                                               k=request.get("top_k", 3))
+        metrics.write(config.METRICS_FILE)
+
+        return {
+            **response,
+            "session_id": session_id,
+            "total": len(roster),
+            "present": sorted(str(scholar) for scholar in present),
+            "unmatched": [
+                [photo_index, [int(v) for v in box], [[str(scholar), distance] for scholar, distance in matches]]
+                for photo_index, box, matches in unknown_faces
+            ],
+        }
+
+
+async def serve(host=config.SERVICE_HOST, port=config.SERVICE_PORT, max_workers=None, on_ready=None):
+    service = RecognitionService(max_workers=max_workers)
+    await service.start(host, port)
+    if on_ready:
+        on_ready(service)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+class ServiceClient:
+    # Blocking client for the CLI and the app; one connection per request.
+    # Photo paths are sent as absolute paths, since the service may run from
+    # another working directory.
+
+    def __init__(self, host=config.SERVICE_HOST, port=config.SERVICE_PORT, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, op, **params):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall((json.dumps({"op": op, **params}) + "\n").encode())
+            with sock.makefile('r', encoding='utf-8') as f:
+                line = f.readline()
+        if not line:
+            raise ServiceError("The recognition service closed the connection.")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise ServiceError(response["error"])
+        return response
+
+    def status(self):
+        return self.request("status")
+
+    def mark(self, subject, branch, semester, photos, date=None, tolerance=None, detection=None,
+             top_k=3, learn=False, session=None, late=False):
+        # With `session` (an id) or `late` (the day's latest session) the
+        # photos are merged into an existing session instead
+        return self.request("mark", subject=subject, branch=branch, semester=str(semester),
+                            photos=[os.path.abspath(photo) for photo in photos], date=date,
+                            tolerance=tolerance, detection=detection, top_k=top_k, learn=learn,
+                            session=session, late=late)
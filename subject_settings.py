@@ -0,0 +1,54 @@
+import pandas as pd
+
+from matching import DEFAULT_TOLERANCE
+from recognition import DEFAULT_DETECTION, DETECTION_PRESETS
+
+# Optional per-subject columns in subjects.csv and their defaults. Subjects
+# created before a column existed simply fall back to the default.
+SETTING_DEFAULTS = {
+    "Tolerance": DEFAULT_TOLERANCE,
+    "Detection": DEFAULT_DETECTION,
+}
+
+# Settings restricted to a fixed set of values
+SETTING_CHOICES = {
+    "Detection": list(DETECTION_PRESETS),
+}
+
+
+def subject_settings(subjects_df, subject, branch, semester):
+    # The spinner lower-cases subject codes, so compare case-insensitively
+    rows = subjects_df[
+        (subjects_df["Subject"].astype(str).str.lower() == str(subject).lower()) &
+        (subjects_df["Branch"].astype(str).str.lower() == str(branch).lower()) &
+        (subjects_df["Semester"].astype(str) == str(semester))
+    ]
+    if rows.empty:
+        return dict(SETTING_DEFAULTS)
+    return row_settings(rows.iloc[0])
+
+
+def row_settings(row):
+    # Settings of one subjects.csv row (a Series); missing or blank columns
+    # fall back to the defaults
+    settings = dict(SETTING_DEFAULTS)
+    for column, default in SETTING_DEFAULTS.items():
+        if column in row.index and not pd.isna(row[column]):
+            settings[column] = type(default)(row[column])
+    return settings
+
+
+def parse_setting(column, text):
+    # Blank input keeps the default; anything else must parse as the
+    # default's type
+    text = str(text).strip()
+    if not text:
+        return SETTING_DEFAULTS[column]
+    default = SETTING_DEFAULTS[column]
+    try:
+        value = type(default)(text)
+    except ValueError:
+        raise ValueError(f"Invalid value for {column}: {text}")
+    if column in SETTING_CHOICES and value not in SETTING_CHOICES[column]:
+        raise ValueError(f"{column} must be one of: {', '.join(SETTING_CHOICES[column])}")
+    return value
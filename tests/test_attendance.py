@@ -0,0 +1,62 @@
+import numpy as np
+
+from face_store import FaceStore
+from attendance_store import AttendanceStore
+from attendance import merge_late_photos
+
+
+def unit(axis, length=1.0):
+    vector = np.zeros(128)
+    vector[axis] = length
+    return vector
+
+
+def test_late_merge_only_learns_for_newly_present_students(tmp_path):
+    face_store = FaceStore(str(tmp_path / "faces.bin"), str(tmp_path / "faces.idx"))
+    enrolled_a, enrolled_b = unit(1, 3.0), unit(3, 3.0)
+    face_store.add_many([("a", enrolled_a), ("b", enrolled_b)])
+
+    # "a" was matched earlier on a face 0.45 from their reference; "b" was absent
+    store = AttendanceStore(str(tmp_path / "attendance.db"))
+    store.setup()
+    earlier_a = enrolled_a + unit(2, 0.45)
+    session_id = store.record_session("dsa", "cse", "5", {"a": 1, "b": 0}, {"a": 0.45}, "2026-10-01",
+                                      faces={"a": earlier_a})
+
+    # Both late faces are within learning range of what they are matched on,
+    # but the one for "a" is 0.75 from their enrolled reference
+    late_a = earlier_a + unit(2, 0.3)
+    late_b = enrolled_b + unit(4, 0.3)
+    faces = np.vstack([late_a, late_b])
+    newly_present, result = merge_late_photos(session_id, [([(0, 1, 1, 0)] * 2, faces)], face_store, store,
+                                              0.5, learn=True)
+
+    assert newly_present == ["b"]
+    assert result.present == {"a", "b"}
+    reader = FaceStore(face_store.matrix_file, face_store.index_file)
+    assert reader.reference_count("a") == 1
+    assert reader.reference_count("b") == 2
+
+
+def test_late_merge_without_stored_faces_and_repeated_photo(tmp_path):
+    face_store = FaceStore(str(tmp_path / "faces.bin"), str(tmp_path / "faces.idx"))
+    face_store.add_many([("a", unit(1, 3.0)), ("b", unit(3, 3.0))])
+
+    # Sessions imported from an old subject CSV have no stored faces
+    store = AttendanceStore(str(tmp_path / "attendance.db"))
+    store.setup()
+    session_id = store.record_session("dsa", "cse", "5", {"a": 1, "b": 0}, date="2026-10-01")
+    assert store.session_faces(session_id)[0] == []
+
+    late_photo = [([(0, 1, 1, 0)], np.vstack([unit(3, 3.0) + unit(4, 0.2)]))]
+    newly_present, _ = merge_late_photos(session_id, late_photo, face_store, store, 0.5)
+    assert newly_present == ["b"]
+    assert store.session_attendance(session_id) == {"a": 1, "b": 1}
+    assert store.session_faces(session_id)[0] == ["b"]
+
+    # Merging the same photo again finds nobody new
+    newly_present, result = merge_late_photos(session_id, late_photo, face_store, store, 0.5)
+    assert newly_present == []
+    assert result.present == {"b"}
+    with store.connect() as connection:
+        assert connection.execute("SELECT attended, held FROM counters WHERE scholar_no = 'b'").fetchone() == (1, 1)
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from attendance_store import AttendanceStore
+
+
+def open_store(tmp_path):
+    store = AttendanceStore(str(tmp_path / "attendance.db"))
+    store.setup()
+    return store
+
+
+def counters(store):
+    with store.connect() as connection:
+        rows = connection.execute("SELECT scholar_no, subject, attended, held FROM counters").fetchall()
+    return {(scholar, subject): (attended, held) for scholar, subject, attended, held in rows}
+
+
+def test_record_session_updates_counters(tmp_path):
+    store = open_store(tmp_path)
+    store.record_session("DSA", "CSE", "5", {"1": 1, "2": 0}, date="2026-10-01")
+    store.record_session("dsa", "cse", "5", {"1": 1, "2": 1}, date="2026-10-02")
+    store.record_session("OS", "CSE", "5", {"1": 0}, date="2026-10-02")
+
+    assert counters(store) == {
+        ("1", "dsa"): (2, 2),
+        ("2", "dsa"): (1, 2),
+        ("1", "os"): (0, 1),
+    }
+    before = counters(store)
+    store.rebuild_counters()
+    assert counters(store) == before
+
+
+def test_export_wide(tmp_path):
+    store = open_store(tmp_path)
+    store.record_session("DSA", "CSE", "5", {"1": 1, "2": 0}, date="2026-10-01")
+    store.record_session("DSA", "CSE", "5", {"1": 0, "2": 1}, date="2026-10-01")
+    store.record_session("DSA", "CSE", "5", {"1": 1}, date="2026-10-02")
+
+    wide_df = store.export_wide("DSA", "CSE", "5", [1, 2, 3])
+    assert list(wide_df.columns) == ["Scholar No", "2026-10-01", "2026-10-01 (2)", "2026-10-02"]
+    assert wide_df.values.tolist() == [[1, 1, 0, 1], [2, 0, 1, 0], [3, 0, 0, 0]]
+
+
+def test_session_ids_of_similar_subjects_differ(tmp_path):
+    store = open_store(tmp_path)
+    first = store.record_session("a-b", "c", "5", {"1": 1}, date="2026-10-01")
+    second = store.record_session("a", "b-c", "5", {"1": 1}, date="2026-10-01")
+    assert first != second
+    assert store.session_attendance(first) == {"1": 1}
+    assert store.session_attendance(second) == {"1": 1}
+
+
+def test_concurrent_sessions_get_distinct_ids(tmp_path):
+    # Each thread has its own connection, like separate processes would
+    store = open_store(tmp_path)
+    session_ids = []
+    errors = []
+
+    def record():
+        try:
+            session_ids.append(store.record_session("DSA", "CSE", "5", {"1": 1, "2": 0}, date="2026-10-01"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(set(session_ids)) == 8
+    assert counters(store)[("1", "dsa")] == (8, 8)
+
+
+def test_merge_adds_to_attended_only_and_is_idempotent(tmp_path):
+    store = open_store(tmp_path)
+    session_id = store.record_session("DSA", "CSE", "5", {"1": 1, "2": 0, "3": 0}, date="2026-10-01")
+
+    assert store.merge_into_session(session_id, {"2": 0.3, "1": 0.2}) == ["2"]
+    assert store.session_attendance(session_id) == {"1": 1, "2": 1, "3": 0}
+    assert counters(store) == {("1", "dsa"): (1, 1), ("2", "dsa"): (1, 1), ("3", "dsa"): (0, 1)}
+
+    # The same late photo again changes nothing
+    assert store.merge_into_session(session_id, {"2": 0.3}) == []
+    assert counters(store) == {("1", "dsa"): (1, 1), ("2", "dsa"): (1, 1), ("3", "dsa"): (0, 1)}
+    before = counters(store)
+    store.rebuild_counters()
+    assert counters(store) == before
+
+
+def test_merge_into_unknown_session(tmp_path):
+    store = open_store(tmp_path)
+    with pytest.raises(KeyError, match="Unknown session"):
+        store.merge_into_session("dsa-cse-5-2026-10-01-1", {"1": 0.3})
@@ -0,0 +1,22 @@
+from bulk_enroll import read_photo_directory, PHOTO_COLUMN
+
+
+def photo_names(tmp_path, *file_names):
+    for file_name in file_names:
+        (tmp_path / file_name).write_bytes(b"")
+    rows = read_photo_directory(str(tmp_path), "CSE", "5")
+    return {row["Scholar No"]: sorted(path.rsplit("/", 1)[-1] for path in row[PHOTO_COLUMN]) for row in rows}
+
+
+def test_extra_photos_join_their_student(tmp_path):
+    assert photo_names(tmp_path, "101.jpg", "101_2.jpg", "101_3.png", "102.jpeg", "notes.txt") == {
+        "101": ["101.jpg", "101_2.jpg", "101_3.png"],
+        "102": ["102.jpeg"],
+    }
+
+
+def test_scholar_numbers_with_underscores_stay_apart(tmp_path):
+    assert photo_names(tmp_path, "2021_0457.jpg", "2021_0458.jpg") == {
+        "2021_0457": ["2021_0457.jpg"],
+        "2021_0458": ["2021_0458.jpg"],
+    }
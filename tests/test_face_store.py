@@ -0,0 +1,43 @@
+import numpy as np
+
+from face_store import FaceStore
+
+
+def encodings(count, seed):
+    return np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+
+
+def test_append_from_stale_instance_keeps_other_rows(tmp_path):
+    matrix_file, index_file = str(tmp_path / "faces.bin"), str(tmp_path / "faces.idx")
+    app_store = FaceStore(matrix_file, index_file)
+    app_store.add_many((f"a{i}", e) for i, e in enumerate(encodings(100, 0)))
+    assert len(app_store) == 100
+
+    # Another process (e.g. a bulk enrollment) appends while the app's store
+    # still has the old rows loaded
+    FaceStore(matrix_file, index_file).add_many((f"b{i}", e) for i, e in enumerate(encodings(50, 1)))
+    late = encodings(1, 2)[0]
+    app_store.add("c0", late)
+
+    reader = FaceStore(matrix_file, index_file)
+    assert len(reader) == 151
+    assert "b49" in reader and "c0" in reader
+    scholars, matrix = reader.get_encodings(["b0", "c0"])
+    assert scholars == ["b0", "c0"]
+    np.testing.assert_array_equal(matrix[0], encodings(50, 1)[0])
+    np.testing.assert_array_equal(matrix[1], late)
+
+
+def test_append_drops_unindexed_rows_of_an_interrupted_append(tmp_path):
+    matrix_file, index_file = str(tmp_path / "faces.bin"), str(tmp_path / "faces.idx")
+    store = FaceStore(matrix_file, index_file)
+    store.add("a", encodings(1, 0)[0])
+
+    # A crash after writing the matrix row but before its index entry
+    with open(matrix_file, 'ab') as f:
+        f.write(encodings(1, 1).tobytes())
+
+    store.add("b", encodings(1, 2)[0])
+    reader = FaceStore(matrix_file, index_file)
+    assert reader.scholar_numbers() == ["a", "b"]
+    np.testing.assert_array_equal(reader.get_encodings(["b"])[1][0], encodings(1, 2)[0])
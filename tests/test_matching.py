@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from matching import assign_faces, match_faces
+
+
+def test_look_alike_does_not_take_a_face_its_owner_needs():
+    # Greedy nearest-first gives face 0 to student 0 and leaves student 1
+    # absent; both can be matched with s0 -> f1 and s1 -> f0
+    distances = np.array([[0.30, 0.31], [0.32, 0.90]])
+    assert assign_faces(distances, 0.5).tolist() == [1, 0]
+
+
+def test_minimum_total_distance_among_full_matchings():
+    distances = np.array([[0.1, 0.3], [0.3, 0.2]])
+    assert assign_faces(distances, 0.5).tolist() == [0, 1]
+
+
+def test_pairs_outside_tolerance_are_never_assigned():
+    distances = np.array([[0.2, 0.9], [0.3, 0.8], [0.9, 0.9]])
+    assert assign_faces(distances, 0.5).tolist() == [0, -1, -1]
+
+
+def test_more_faces_than_students_and_empty_inputs():
+    assert assign_faces(np.array([[0.4, 0.1, 0.3]]), 0.5).tolist() == [1]
+    assert assign_faces(np.empty((2, 0)), 0.5).tolist() == [-1, -1]
+    assert assign_faces(np.empty((0, 3)), 0.5).tolist() == []
+
+
+def test_assignment_is_one_to_one_on_random_blocks():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        distances = rng.random((rng.integers(1, 8), rng.integers(1, 8)))
+        assigned = assign_faces(distances, 0.5)
+        faces = assigned[assigned >= 0]
+        assert len(set(faces.tolist())) == len(faces)
+        assert all(distances[s, f] <= 0.5 for s, f in enumerate(assigned) if f >= 0)
+
+
+def test_match_faces_marks_both_students():
+    known = np.zeros((2, 128))
+    known[1, 0] = 1.0
+    faces = np.zeros((2, 128))
+    faces[0, 0] = 0.6
+    faces[1, 0] = 0.1
+    result = match_faces(["a", "b"], known, [faces], tolerance=0.5)
+    assert result.present == {"a", "b"}
+
+
+def test_assigned_distances_follow_scholars():
+    known = np.zeros((3, 128))
+    known[1, 0] = 1.0
+    known[2, 0] = 5.0
+    faces = np.zeros((2, 128))
+    faces[0, 0] = 0.9
+    faces[1, 0] = 0.2
+    result = match_faces(["a", "b", "c"], known, [faces], tolerance=0.5)
+    distances = result.assigned_distance_map()
+    assert distances["a"] == pytest.approx(0.2)
+    assert distances["b"] == pytest.approx(0.1)
+    assert distances["c"] is None
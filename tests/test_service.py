@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import service as service_module
+from face_store import FaceStore
+from service import ServiceClient, ServiceError, serve
+
+
+def unit(axis, length=1.0):
+    vector = np.zeros(128)
+    vector[axis] = length
+    return vector
+
+
+# Faces "seen" in each test photo; the stub encoder stands in for dlib
+PHOTO_FACES = {
+    "class.jpg": [unit(1), unit(2)],
+    "front.jpg": [unit(1)],
+}
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    # Photo name -> how many times it went through the encoder
+    counts = Counter()
+    lock = threading.Lock()
+
+    def encode_batch(jobs):
+        results = []
+        for photo, detection in jobs:
+            name = photo.replace("\\", "/").rsplit("/", 1)[-1]
+            with lock:
+                counts[name] += 1
+            if name not in PHOTO_FACES:
+                results.append((False, f"{name}: cannot identify image file"))
+                continue
+            faces = np.asarray(PHOTO_FACES[name])
+            results.append((True, (([(0, 1, 1, 0)] * len(faces), faces), {}, None)))
+        return results
+
+    monkeypatch.setattr(service_module, "encode_batch", encode_batch)
+    return counts
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, encoded):
+    # A service on a free localhost port, running from a data folder with
+    # one subject (DSA, CSE, 5) of two enrolled students
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "students.csv").write_text(
+        "Student Name,Scholar No,Branch,Semester,Email ID\n"
+        "Asha,1,CSE,5,asha@example.com\nBilal,2,CSE,5,bilal@example.com\n")
+    (tmp_path / "subjects.csv").write_text("Subject,Branch,Semester\nDSA,CSE,5\n")
+    (tmp_path / "dsa-cse-5.csv").write_text("Scholar No\n1\n2\n")
+    for name in list(PHOTO_FACES) + ["bad.jpg"]:
+        (tmp_path / name).write_bytes(name.encode())
+    FaceStore("faces.bin", "faces.idx").add_many([("1", unit(1)), ("2", unit(2))])
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    services = []
+
+    def on_ready(service):
+        # Jobs run on threads so the stubbed encoder is the one called
+        service.pool.shutdown()
+        service.pool = ThreadPoolExecutor(max_workers=service.max_workers)
+        services.append(service)
+        ready.set()
+
+    async def run():
+        try:
+            await serve("127.0.0.1", 0, max_workers=2, on_ready=on_ready)
+        except asyncio.CancelledError:
+            pass
+
+    task = loop.create_task(run())
+    thread = threading.Thread(target=loop.run_until_complete, args=(task,), daemon=True)
+    thread.start()
+    assert ready.wait(10)
+    host, port = services[0].address
+    yield ServiceClient(host, port, timeout=10)
+
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(10)
+    loop.close()
+
+
+def mark_concurrently(client, *photo_lists):
+    # One request per photo list, all sent at once; returns the response or
+    # the ServiceError of each
+    def mark(photos):
+        try:
+            return client.mark("DSA", "CSE", 5, photos)
+        except ServiceError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(photo_lists)) as pool:
+        return list(pool.map(mark, photo_lists))
+
+
+def test_status(client):
+    status = client.status()
+    assert status["workers"] == 2
+    assert status["busy"] == 0
+    assert status["photos_encoded"] == 0
+
+
+def test_identical_photos_are_encoded_once(client, encoded):
+    responses = mark_concurrently(client, ["class.jpg"], ["class.jpg"], ["class.jpg"])
+    for response in responses:
+        assert response["present"] == ["1", "2"]
+        assert response["total"] == 2
+    assert len({response["session_id"] for response in responses}) == 3
+    assert encoded["class.jpg"] == 1
+    assert client.status()["photos_encoded"] == 1
+
+
+def test_bad_photo_only_fails_its_own_request(client):
+    bad, good = mark_concurrently(client, ["bad.jpg"], ["front.jpg"])
+    assert isinstance(bad, ServiceError)
+    assert "bad.jpg" in str(bad)
+    assert good["present"] == ["1"]
+
+
+def test_unknown_subject(client):
+    with pytest.raises(ServiceError, match="Unknown subject"):
+        client.mark("OS", "CSE", 5, ["class.jpg"])
+
+
+def test_missing_photo(client):
+    with pytest.raises(ServiceError, match="Photo not found"):
+        client.mark("DSA", "CSE", 5, ["absent.jpg"])
@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+import numpy as np
+
+from recognition import detection_params, detect_faces, load_image, rescale_boxes, suppress_overlaps
+
+# Tiled detection for panoramas too wide to detect in one frame. The photo is
+# decoded once (capped at the preset's decode_pixels, JPEGs at a reduced DCT
+# scale) into a memory-mapped .npy file; the worker doing that holds the
+# decoded photo while it writes it. Each overlapping tile is then copied out
+# of the map, detected and encoded on its own, so a tile worker only holds
+# its own tile. Faces found twice where tiles overlap are merged with the
+# same box suppression as the back-row pass. The overlap has to be wider than
+# the largest face, so that every face lies whole inside at least one tile.
+
+
+def is_tiled(detection):
+    return bool(detection_params(detection).get("tile_size"))
+
+
+def tile_windows(height, width, tile_size, overlap):
+    # (top, left, bottom, right) of overlapping tiles covering the frame
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, tile_size - overlap)) + [length - tile_size]
+
+    return [
+        (top, left, min(height, top + tile_size), min(width, left + tile_size))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def prepare_tiles(photo_path, detection, work_dir):
+    # Worker step 1: decode the photo into work_dir and plan its tiles.
+    # Returns ((pixel file, scale, (height, width), windows), stages, peak RSS).
+    from instrumentation import StageTimer, peak_rss_mb
+
+    params = detection_params(detection)
+    timer = StageTimer()
+    with timer.stage("decode"):
+        image, scale = load_image(photo_path, None, params["decode_pixels"])
+        fd, pixel_file = tempfile.mkstemp(suffix=".npy", dir=work_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, image)
+    height, width = image.shape[:2]
+    windows = tile_windows(height, width, params["tile_size"], params["tile_overlap"])
+    return (pixel_file, scale, (height, width), windows), timer.stages, peak_rss_mb()
+
+
+def encode_tile_timed(pixel_file, window, detection):
+    # Worker step 2: detect and encode the faces of one tile. Boxes come back
+    # in the coordinates of the decoded photo.
+    import face_recognition
+    from instrumentation import StageTimer, peak_rss_mb
+
+    timer = StageTimer()
+    top, left, bottom, right = window
+    with timer.stage("tile"):
+        tile = np.ascontiguousarray(np.load(pixel_file, mmap_mode='r')[top:bottom, left:right])
+    with timer.stage("detection"):
+        locations = detect_faces(tile, detection)
+    with timer.stage("encoding"):
+        encodings = face_recognition.face_encodings(tile, locations)
+
+    boxes = [(t + top, r + left, b + top, l + left) for t, r, b, l in locations]
+    return (boxes, np.asarray(encodings, dtype=np.float64).reshape(-1, 128)), timer.stages, peak_rss_mb()
+
+
+def merge_tiles(tile_results, scale, shape):
+    # One (locations, encodings) result for the photo: duplicates at tile
+    # seams are suppressed and boxes are mapped to original-photo pixels
+    encoding_of = {}
+    for boxes, encodings in tile_results:
+        for box, encoding in zip(boxes, encodings):
+            encoding_of[tuple(box)] = encoding
+
+    kept = suppress_overlaps(list(encoding_of))
+    height, width = (round(side / scale) for side in shape)
+    encodings = np.asarray([encoding_of[box] for box in kept], dtype=np.float64).reshape(-1, 128)
+    return rescale_boxes(kept, scale, height, width), encodings
+
+
+def combine_stages(stage_dicts):
+    # Sum per-stage timings of the steps that made up one photo
+    combined = {}
+    for stages in stage_dicts:
+        for name, stage in stages.items():
+            total = combined.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            total["wall"] += stage["wall"]
+            total["cpu"] += stage["cpu"]
+    return combined
+
+
+def encode_tiled_timed(photo_path, detection, work_dir=None):
+    # All tiles of one photo in this process, one after the other; used
+    # where the photo is already a single job (the recognition service).
+    # run_photo_pool spreads the tiles over its pool instead.
+    from instrumentation import peak_rss_mb
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tile_dir:
+        (pixel_file, scale, shape, windows), stages, _ = prepare_tiles(photo_path, detection, tile_dir)
+        tile_results = []
+        all_stages = [stages]
+        for window in windows:
+            tile_result, stages, _ = encode_tile_timed(pixel_file, window, detection)
+            tile_results.append(tile_result)
+            all_stages.append(stages)
+    return merge_tiles(tile_results, scale, shape), combine_stages(all_stages), peak_rss_mb()
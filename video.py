@@ -0,0 +1,218 @@
+import os
+
+import numpy as np
+
+from recognition import detect_faces, box_overlap
+from matching import face_distance_matrix
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".m4v", ".3gp")
+
+# Sampling interval in seconds: starts at BASE, halves while the camera is
+# moving (new faces come into view) and doubles while it holds still
+BASE_INTERVAL = 0.5
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 2.0
+# Mean absolute difference (0-255) between sampled thumbnails that counts as
+# movement
+MOTION_THRESHOLD = 12.0
+
+# A detection joins a track when it overlaps the track's last box this much
+TRACK_OVERLAP = 0.3
+# Tracks not seen for this many samples are closed
+MAX_MISSED_SAMPLES = 3
+# Candidate frames kept per track, and how many of them get encoded
+CANDIDATES_PER_TRACK = 5
+ENCODINGS_PER_TRACK = 2
+# Tracks whose encodings are this close are the same person seen twice
+DUPLICATE_DISTANCE = 0.4
+# Padding around a face when its crop is kept for encoding
+CROP_PADDING = 0.3
+
+# Detection mode for videos unless the user picks one explicitly. A subject's
+# photo preset would run its upsampled back-row pass on every sampled frame,
+# while a pan brings each face close to the camera at some point anyway.
+VIDEO_DETECTION = "fast"
+
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def detection_for(path, detection, video_detection=VIDEO_DETECTION):
+    # Detection mode of one upload: `detection` for photos, `video_detection`
+    # for videos
+    return video_detection if is_video(path) else detection
+
+
+def sharpness(image):
+    # Variance of the Laplacian of the grey image; blurred faces score low
+    grey = image.astype(np.float32).mean(axis=2)
+    laplacian = (4 * grey[1:-1, 1:-1] - grey[:-2, 1:-1] - grey[2:, 1:-1]
+                 - grey[1:-1, :-2] - grey[1:-1, 2:])
+    return float(laplacian.var()) if laplacian.size else 0.0
+
+
+def frontalness(landmarks):
+    # 1.0 when the nose tip sits halfway between the eyes, falling off as the
+    # head turns. Uses the 5-point landmark model.
+    left_eye = np.mean(landmarks["left_eye"], axis=0)
+    right_eye = np.mean(landmarks["right_eye"], axis=0)
+    nose = np.mean(landmarks["nose_tip"], axis=0)
+    left = np.linalg.norm(nose - left_eye)
+    right = np.linalg.norm(nose - right_eye)
+    return float(min(left, right) / max(left, right)) if max(left, right) > 0 else 0.0
+
+
+def padded_crop(frame, box):
+    # Crop around a (top, right, bottom, left) box; returns the crop and the
+    # box in crop coordinates
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * CROP_PADDING)
+    pad_x = int((right - left) * CROP_PADDING)
+    y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+    y1, x1 = min(frame.shape[0], bottom + pad_y), min(frame.shape[1], right + pad_x)
+    crop = np.ascontiguousarray(frame[y0:y1, x0:x1])
+    return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+
+class Track:
+    def __init__(self, box):
+        self.box = box
+        self.missed = 0
+        # (sharpness, frame box, crop, crop box), best first
+        self.candidates = []
+
+    def add(self, frame, box):
+        self.box = box
+        self.missed = 0
+        crop, crop_box = padded_crop(frame, box)
+        top, right, bottom, left = crop_box
+        score = sharpness(crop[top:bottom, left:right])
+        self.candidates.append((score, box, crop, crop_box))
+        self.candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        del self.candidates[CANDIDATES_PER_TRACK:]
+
+
+def update_tracks(tracks, frame, boxes):
+    # Greedily extend the open tracks with the best-overlapping boxes; boxes
+    # nobody claims start new tracks
+    pairs = sorted(
+        ((box_overlap(track.box, box), t, b) for t, track in enumerate(tracks) for b, box in enumerate(boxes)),
+        reverse=True,
+    )
+    used_tracks, used_boxes = set(), set()
+    for overlap, t, b in pairs:
+        if overlap < TRACK_OVERLAP:
+            break
+        if t in used_tracks or b in used_boxes:
+            continue
+        tracks[t].add(frame, boxes[b])
+        used_tracks.add(t)
+        used_boxes.add(b)
+
+    for t, track in enumerate(tracks):
+        if t not in used_tracks:
+            track.missed += 1
+    for b, box in enumerate(boxes):
+        if b not in used_boxes:
+            track = Track(box)
+            track.add(frame, box)
+            tracks.append(track)
+
+
+def sample_frames(video_path):
+    # Yields RGB frames at an interval that adapts to camera motion
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        interval = BASE_INTERVAL
+        previous_thumbnail = None
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36)).astype(np.float32)
+            if previous_thumbnail is not None:
+                motion = float(np.abs(thumbnail - previous_thumbnail).mean())
+                if motion > MOTION_THRESHOLD:
+                    interval = max(MIN_INTERVAL, interval / 2)
+                else:
+                    interval = min(MAX_INTERVAL, interval * 2)
+            previous_thumbnail = thumbnail
+
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+            # Skip ahead without converting the frames in between; grab() is
+            # cheaper than read() and more reliable than seeking
+            for _ in range(max(1, int(round(interval * fps))) - 1):
+                if not capture.grab():
+                    return
+    finally:
+        capture.release()
+
+
+def encode_track(track):
+    # Encode the track's sharpest, most frontal candidates and average them
+    import face_recognition
+
+    scored = []
+    for score, box, crop, crop_box in track.candidates:
+        landmarks = face_recognition.face_landmarks(crop, [crop_box], model='small')
+        frontal = frontalness(landmarks[0]) if landmarks else 0.0
+        scored.append((frontal * score, box, crop, crop_box))
+    scored.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    encodings = [
+        face_recognition.face_encodings(crop, [crop_box])[0]
+        for _, _, crop, crop_box in scored[:ENCODINGS_PER_TRACK]
+    ]
+    return scored[0][1], np.mean(encodings, axis=0)
+
+
+def merge_duplicate_tracks(boxes, encodings):
+    # A student who leaves the frame and comes back starts a second track;
+    # keep one encoding per identity
+    if len(encodings) < 2:
+        return boxes, encodings
+    distances = face_distance_matrix(encodings, encodings)
+    kept = []
+    for index in range(len(encodings)):
+        if all(distances[index, other] > DUPLICATE_DISTANCE for other in kept):
+            kept.append(index)
+    return [boxes[i] for i in kept], encodings[kept]
+
+
+def encode_video_timed(video_path, detection=VIDEO_DETECTION):
+    # Video counterpart of recognition.encode_photo_timed: one deduplicated
+    # encoding per person seen in the clip, returned like a single photo
+    from instrumentation import StageTimer, peak_rss_mb
+
+    timer = StageTimer()
+    tracks = []
+    closed = []
+    frames = sample_frames(video_path)
+    while True:
+        with timer.stage("decode"):
+            frame = next(frames, None)
+        if frame is None:
+            break
+        with timer.stage("detection"):
+            boxes = detect_faces(frame, detection)
+        with timer.stage("tracking"):
+            update_tracks(tracks, frame, boxes)
+            closed += [track for track in tracks if track.missed > MAX_MISSED_SAMPLES]
+            tracks = [track for track in tracks if track.missed <= MAX_MISSED_SAMPLES]
+
+    with timer.stage("encoding"):
+        encoded = [encode_track(track) for track in closed + tracks]
+        boxes = [box for box, _ in encoded]
+        encodings = np.asarray([encoding for _, encoding in encoded], dtype=np.float64).reshape(-1, 128)
+        boxes, encodings = merge_duplicate_tracks(boxes, encodings)
+
+    return (boxes, encodings), timer.stages, peak_rss_mb()